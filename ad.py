@@ -0,0 +1,143 @@
+import html
+import re
+from dataclasses import asdict, dataclass, field
+from enum import Enum
+
+from utils import normalize_url, today_at
+
+
+surface_area_pattern = re.compile(r"(\d+(?:[.,]\d+)?)")
+card_area_pattern = re.compile(r"(\d+(?:[.,]\d+)?)\s*m²")
+
+
+class OwnerType(Enum):
+    PRIVATE = "private"
+    BUSINESS = "business"
+    DEVELOPER = "developer"
+    UNKNOWN = "unknown"
+
+
+@dataclass(slots=True)
+class Ad:
+    """
+    Scraped ad with everything the send loop needs computed once at scrape time
+    """
+
+    title: str
+    price: str
+    location: str
+    publication_time: str
+    features: list[str]
+    url: str
+    canonical_url: str
+    image: str
+    caption: str
+    price_value: int | None = None
+    area: float | None = None
+    owner_type: OwnerType = OwnerType.UNKNOWN
+    published_at: str | None = None
+    coordinates: tuple[float, float] | None = None
+    images: list[str] = field(default_factory=list)
+    scraped_at: float | None = None  # Unix time the ad's page was parsed at
+
+    @classmethod
+    def from_parsed(cls, item: dict) -> "Ad":
+        return cls(
+            title=item["title"],
+            price=item["price"],
+            location=item["location"],
+            publication_time=item["publication_time"],
+            features=item["features"],
+            url=item["item_link"],
+            canonical_url=normalize_url(item["item_link"]),
+            image=item["item_img"],
+            caption=render_caption(item),
+            price_value=parse_price(item["price"]),
+            area=item.get("area") or parse_surface_area(item["features"]),
+            owner_type=parse_owner_type(item),
+            published_at=item.get("published_at") or parse_published_at(item["publication_time"]),
+            coordinates=item.get("coordinates"),
+            images=item.get("images") or [],
+        )
+
+    def to_dict(self) -> dict:
+        """
+        JSON-serializable fields, for passing the ad between workers
+        """
+        item = asdict(self)
+        item["owner_type"] = self.owner_type.value
+        return item
+
+    @classmethod
+    def from_dict(cls, item: dict) -> "Ad":
+        coordinates = item.get("coordinates")
+        return cls(
+            **{
+                **item,
+                "owner_type": OwnerType(item["owner_type"]),
+                "coordinates": tuple(coordinates) if coordinates else None,
+            }
+        )
+
+
+@dataclass(slots=True)
+class Card:
+    """
+    Fields shown on a listing card, enough to filter out ads before their detail page is fetched
+    """
+
+    url: str
+    price_value: int | None = None
+    area: float | None = None
+
+
+def render_caption(item: dict) -> str:
+    location = item["location"][:40] + "..." if len(item["location"]) > 40 else item["location"]
+    features = "".join(f"▫️ {html.escape(feature)}\n" for feature in item["features"])
+    return (
+        f"<strong><a href='{item['item_link']}'>{html.escape(item['title'])}</a></strong>\n\n"
+        f"{html.escape(item['price'])} | {html.escape(location)}\n"
+        f"Published: {item['publication_time']}\n\n"
+        f"Features: \n{features}"
+    )
+
+
+def parse_price(price: str) -> int | None:
+    digits = "".join(char for char in price if char.isdecimal())
+    return int(digits) if digits else None
+
+
+def parse_surface_area(features: list[str]) -> float | None:
+    surface_area_str = next(
+        (feature for feature in features if "powierzchnia" in feature.lower()), None
+    )
+    if surface_area_str is None:
+        return None
+
+    match = surface_area_pattern.search(surface_area_str)
+    return float(match.group(1).replace(",", ".")) if match else None
+
+
+def parse_card_area(text: str) -> float | None:
+    match = card_area_pattern.search(text)
+    return float(match.group(1).replace(",", ".")) if match else None
+
+
+def parse_published_at(publication_time: str | None) -> str | None:
+    # Page markup only has the time of today's ads
+    published_at = today_at(publication_time) if publication_time else None
+    return published_at.isoformat() if published_at else None
+
+
+def parse_owner_type(item: dict) -> OwnerType:
+    if item.get("owner_type") in OwnerType._value2member_map_:
+        return OwnerType(item["owner_type"])
+
+    joined_features = " ".join(item["features"]).lower()
+    if "deweloper" in joined_features:
+        return OwnerType.DEVELOPER
+    elif "prywatn" in joined_features:
+        return OwnerType.PRIVATE
+    elif "firmow" in joined_features or "biuro" in joined_features:
+        return OwnerType.BUSINESS
+    return OwnerType.UNKNOWN
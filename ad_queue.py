@@ -0,0 +1,307 @@
+import asyncio
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from itertools import islice
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+from sqlalchemy import (
+    Column,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    delete,
+    event,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from ad import Ad
+from db.config import SQLITE_BUSY_TIMEOUT, apply_sqlite_pragmas
+
+
+load_dotenv()
+
+# Where scraper workers publish parsed ads for sender workers: a SQLite file is enough
+# for workers on one machine and "redis://host:6379/0" serves several machines
+AD_QUEUE_URL = os.getenv("AD_QUEUE_URL", "sqlite+aiosqlite:///ad_queue.sqlite")
+# Ads are kept this long, so a restarted sender catches up on what it missed
+AD_QUEUE_RETENTION = float(os.getenv("AD_QUEUE_RETENTION", 60 * 60))
+AD_QUEUE_BATCH_SIZE = int(os.getenv("AD_QUEUE_BATCH_SIZE", 100))
+# SQL databases have no blocking reads, so senders check them for new ads this often
+AD_QUEUE_POLL_INTERVAL = float(os.getenv("AD_QUEUE_POLL_INTERVAL", 1))
+AD_QUEUE_TRIM_INTERVAL = 60
+
+Feed = tuple[str, str, str]
+
+
+@dataclass(slots=True)
+class QueuedAd:
+    offset: str  # opaque position in the log, a consumer resumes after the last committed one
+    feed: Feed
+    ad: Ad
+
+
+class AdQueue(ABC):
+    """
+    Append-only log of parsed ads with a committed offset per consumer, so every sender
+    reads every ad and a restarted one resumes where it stopped. Ads older than the retention
+    are trimmed, reading from no offset starts from the oldest kept ad
+    """
+
+    @abstractmethod
+    async def publish(self, feed: Feed, ad: Ad) -> None: ...
+
+    @abstractmethod
+    async def read(
+        self, after: str | None, limit: int = AD_QUEUE_BATCH_SIZE, timeout: float = 0
+    ) -> list[QueuedAd]:
+        """
+        Ads after the `after` offset, waits up to `timeout` seconds for new ones
+        """
+
+    @abstractmethod
+    async def committed(self, consumer: str) -> str | None: ...
+
+    @abstractmethod
+    async def commit(self, consumer: str, offset: str) -> None: ...
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryAdQueue(AdQueue):
+    """
+    Log kept in the process, a stand-in for the shared backends in tests
+    """
+
+    def __init__(self, retention: float = AD_QUEUE_RETENTION):
+        self.retention = retention
+        self._entries: deque[tuple[int, float, Feed, Ad]] = deque()
+        self._next_offset = 0
+        self._offsets: dict[str, str] = {}
+        self._published = asyncio.Condition()
+
+    async def publish(self, feed: Feed, ad: Ad) -> None:
+        async with self._published:
+            now = time.time()
+            self._entries.append((self._next_offset, now, feed, ad))
+            self._next_offset += 1
+            while self._entries[0][1] < now - self.retention:
+                self._entries.popleft()
+            self._published.notify_all()
+
+    async def read(
+        self, after: str | None, limit: int = AD_QUEUE_BATCH_SIZE, timeout: float = 0
+    ) -> list[QueuedAd]:
+        offset = int(after) if after is not None else -1
+        async with self._published:
+            if self._next_offset - 1 <= offset and timeout > 0:
+                try:
+                    await asyncio.wait_for(
+                        self._published.wait_for(lambda: self._next_offset - 1 > offset), timeout
+                    )
+                except asyncio.TimeoutError:
+                    return []
+
+            start = max(offset + 1 - self._entries[0][0], 0) if self._entries else 0
+            return [
+                QueuedAd(str(entry_offset), feed, ad)
+                for entry_offset, _, feed, ad in islice(self._entries, start, start + limit)
+            ]
+
+    async def committed(self, consumer: str) -> str | None:
+        return self._offsets.get(consumer)
+
+    async def commit(self, consumer: str, offset: str) -> None:
+        self._offsets[consumer] = offset
+
+
+metadata = MetaData()
+
+queued_ads = Table(
+    "queued_ads",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("published_at", Float, nullable=False, index=True),
+    Column("city", String, nullable=False),
+    Column("ad_type", String, nullable=False),
+    Column("building_type", String, nullable=False),
+    Column("ad", String, nullable=False),
+    # Trimmed ids must never be reused, consumers would skip the new ads
+    sqlite_autoincrement=True,
+)
+
+consumer_offsets = Table(
+    "consumer_offsets",
+    metadata,
+    Column("consumer", String, primary_key=True),
+    Column("last_id", Integer, nullable=False),
+)
+
+
+class SqlAdQueue(AdQueue):
+    """
+    Log in its own database, created on first use since its content is short-lived
+    """
+
+    def __init__(
+        self,
+        url: str,
+        retention: float = AD_QUEUE_RETENTION,
+        poll_interval: float = AD_QUEUE_POLL_INTERVAL,
+    ):
+        self.retention = retention
+        self.poll_interval = poll_interval
+        if url.startswith("sqlite"):
+            self._engine = create_async_engine(
+                url, connect_args={"timeout": SQLITE_BUSY_TIMEOUT / 1000}
+            )
+            event.listen(self._engine.sync_engine, "connect", apply_sqlite_pragmas)
+        else:
+            self._engine = create_async_engine(url)
+        self._setup_lock = asyncio.Lock()
+        self._is_set_up = False
+        self._trimmed_at = 0.0
+
+    async def publish(self, feed: Feed, ad: Ad) -> None:
+        await self._setup()
+        city, ad_type, building_type = feed
+        now = time.time()
+        async with self._engine.begin() as connection:
+            await connection.execute(
+                insert(queued_ads).values(
+                    published_at=now,
+                    city=city,
+                    ad_type=ad_type,
+                    building_type=building_type,
+                    ad=json.dumps(ad.to_dict()),
+                )
+            )
+            if now - self._trimmed_at >= AD_QUEUE_TRIM_INTERVAL:
+                await connection.execute(
+                    delete(queued_ads).where(queued_ads.c.published_at < now - self.retention)
+                )
+                self._trimmed_at = now
+
+    async def read(
+        self, after: str | None, limit: int = AD_QUEUE_BATCH_SIZE, timeout: float = 0
+    ) -> list[QueuedAd]:
+        await self._setup()
+        deadline = time.monotonic() + timeout
+        while True:
+            async with self._engine.connect() as connection:
+                rows = await connection.execute(
+                    select(queued_ads)
+                    .where(queued_ads.c.id > int(after or 0))
+                    .order_by(queued_ads.c.id)
+                    .limit(limit)
+                )
+                entries = [
+                    QueuedAd(
+                        str(row.id),
+                        (row.city, row.ad_type, row.building_type),
+                        Ad.from_dict(json.loads(row.ad)),
+                    )
+                    for row in rows
+                ]
+
+            now = time.monotonic()
+            if entries or now >= deadline:
+                return entries
+            await asyncio.sleep(min(self.poll_interval, deadline - now))
+
+    async def committed(self, consumer: str) -> str | None:
+        await self._setup()
+        async with self._engine.connect() as connection:
+            last_id = await connection.scalar(
+                select(consumer_offsets.c.last_id).where(consumer_offsets.c.consumer == consumer)
+            )
+        return str(last_id) if last_id is not None else None
+
+    async def commit(self, consumer: str, offset: str) -> None:
+        await self._setup()
+        async with self._engine.begin() as connection:
+            result = await connection.execute(
+                update(consumer_offsets)
+                .where(consumer_offsets.c.consumer == consumer)
+                .values(last_id=int(offset))
+            )
+            if not result.rowcount:
+                await connection.execute(
+                    insert(consumer_offsets).values(consumer=consumer, last_id=int(offset))
+                )
+
+    async def close(self) -> None:
+        await self._engine.dispose()
+
+    async def _setup(self) -> None:
+        async with self._setup_lock:
+            if not self._is_set_up:
+                async with self._engine.begin() as connection:
+                    await connection.run_sync(metadata.create_all)
+                self._is_set_up = True
+
+
+class RedisAdQueue(AdQueue):
+    """
+    Log in a Redis stream, for workers on several machines
+    """
+
+    stream = "rent_finder:ads"
+    offsets = "rent_finder:ad_offsets"
+
+    def __init__(self, url: str, retention: float = AD_QUEUE_RETENTION):
+        # Only this backend needs the redis package
+        from redis.asyncio import Redis
+
+        self.retention = retention
+        self._redis = Redis.from_url(url, decode_responses=True)
+
+    async def publish(self, feed: Feed, ad: Ad) -> None:
+        # Stream ids start with the publication time in ms, so old ads are trimmed by id
+        min_id = int((time.time() - self.retention) * 1000)
+        await self._redis.xadd(
+            self.stream, {"feed": json.dumps(feed), "ad": json.dumps(ad.to_dict())}, minid=min_id
+        )
+
+    async def read(
+        self, after: str | None, limit: int = AD_QUEUE_BATCH_SIZE, timeout: float = 0
+    ) -> list[QueuedAd]:
+        # 0 would block forever
+        block = max(int(timeout * 1000), 1) if timeout > 0 else None
+        response = await self._redis.xread({self.stream: after or "0"}, count=limit, block=block)
+        return [
+            QueuedAd(
+                entry_id, tuple(json.loads(fields["feed"])), Ad.from_dict(json.loads(fields["ad"]))
+            )
+            for _, entries in response or []
+            for entry_id, fields in entries
+        ]
+
+    async def committed(self, consumer: str) -> str | None:
+        return await self._redis.hget(self.offsets, consumer)
+
+    async def commit(self, consumer: str, offset: str) -> None:
+        await self._redis.hset(self.offsets, consumer, offset)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_ad_queue(url: str = AD_QUEUE_URL) -> AdQueue:
+    scheme = urlsplit(url).scheme
+    if scheme == "memory":
+        # Only useful in tests, senders in other processes can't read it
+        return MemoryAdQueue()
+    if scheme in ("redis", "rediss"):
+        return RedisAdQueue(url)
+    return SqlAdQueue(url)
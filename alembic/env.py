@@ -5,7 +5,7 @@ from sqlalchemy import pool
 
 from alembic import context
 
-from db.config import Base, User, SentAd
+from db.config import Base, User, SentAd, Broadcast
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
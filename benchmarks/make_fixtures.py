@@ -0,0 +1,337 @@
+"""
+Pads the small checked-in fixtures to the size and structure of real OLX and Otodom pages:
+head metadata and preloads, a large inline style block, script bundles, navigation, an icon
+sprite, similar ads, a footer and the full embedded state. Real pages can't be checked in,
+they carry personal data, and the padding doesn't touch anything the parsers read.
+
+The padding is seeded, so every run measures the same pages. To look at them:
+
+    python -m benchmarks.make_fixtures --output padded_fixtures
+"""
+
+import argparse
+import json
+import random
+import string
+from pathlib import Path
+
+from parsers import olx_state_pattern, otodom_state_pattern
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+SEED = 20241105
+
+WORDS = (
+    "mieszkanie pokój kawalerka dom balkon garaż winda piwnica ogród taras kuchnia łazienka "
+    "salon sypialnia komunikacja tramwaj centrum osiedle blok kamienica apartament wynajem "
+    "sprzedaż cena czynsz media kaucja umeblowane nowe budownictwo parking komórka lokatorska "
+    "szkoła przedszkole sklep park rower spokojna okolica widok słoneczne jasne przestronne "
+    "remont wyposażenie pralka zmywarka lodówka piekarnik klimatyzacja ogrzewanie miejskie"
+).split()
+CITIES = "Kraków Warszawa Wrocław Gdańsk Poznań Łódź Katowice Lublin Szczecin Bydgoszcz".split()
+CSS_PROPERTIES = [
+    "display:flex",
+    "display:grid",
+    "display:block",
+    "position:relative",
+    "position:absolute",
+    "flex-direction:column",
+    "align-items:center",
+    "justify-content:space-between",
+    "margin:0",
+    "padding:8px 16px",
+    "font-size:14px",
+    "line-height:20px",
+    "font-weight:500",
+    "color:#002f34",
+    "background-color:#ffffff",
+    "border-radius:4px",
+    "overflow:hidden",
+    "text-overflow:ellipsis",
+    "white-space:nowrap",
+    "cursor:pointer",
+    "width:100%",
+    "max-width:1200px",
+    "gap:16px",
+    "transition:background-color .2s ease-in-out",
+    "box-shadow:0 1px 2px rgba(0,47,52,.16)",
+    "border:1px solid #d8dfe0",
+    "z-index:1",
+]
+
+
+def words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def css_class(rng: random.Random) -> str:
+    return "css-" + "".join(rng.choices(string.ascii_lowercase + string.digits, k=7))
+
+
+def chunk_name(rng: random.Random) -> str:
+    return "".join(rng.choices(string.hexdigits.lower(), k=16))
+
+
+def make_styles(rng: random.Random, rules: int) -> str:
+    css = []
+    for _ in range(rules):
+        selector = "." + css_class(rng)
+        if rng.random() < 0.3:
+            selector += rng.choice([":hover", ":focus-visible", ">div", " a", "::after"])
+        css.append(f"{selector}{{{';'.join(rng.sample(CSS_PROPERTIES, rng.randint(2, 7)))};}}")
+        if rng.random() < 0.05:
+            width = rng.choice([480, 768, 1024, 1280])
+            declarations = ";".join(rng.sample(CSS_PROPERTIES, 3))
+            css.append(f"@media (min-width:{width}px){{.{css_class(rng)}{{{declarations};}}}}")
+    return "".join(css)
+
+
+def make_bundle(rng: random.Random, size: int) -> str:
+    """
+    Minified webpack chunk of about `size` characters
+    """
+    modules = []
+    total = 0
+    while total < size:
+        a, b, c, d = ("".join(rng.choices(string.ascii_letters, k=2)) for _ in range(4))
+        module = (
+            f'{rng.randint(10000, 99999)}:function({a},{b},{c}){{"use strict";'
+            f"{c}.d({b},{{Z:function(){{return {d}}}}});"
+            f"var {d}=function({a}){{var {b}={a}.{rng.choice(['data', 'items', 'params'])},"
+            f"{c}=void 0==={b}?[]:{b};return {c}.filter(function({a}){{return null!=={a}"
+            f'&&{a}.id!=="{rng.choice(WORDS)}"}}).map(function({a},{b}){{return{{key:{a}.key||{b},'
+            f'label:"{words(rng, 3)}",href:"/{rng.choice(WORDS)}/".concat({a}.id)}}}})}};'
+            f"{c}.r({b})}}"
+        )
+        modules.append(module)
+        total += len(module)
+    return (
+        f"(self.webpackChunk_N_E=self.webpackChunk_N_E||[]).push([[{rng.randint(100, 9999)}],"
+        f"{{{','.join(modules)}}}]);"
+    )
+
+
+def make_config(rng: random.Random) -> dict:
+    return {
+        "featureFlags": {
+            f"{rng.choice(WORDS)}_{index}": rng.random() < 0.5 for index in range(300)
+        },
+        "experiments": {f"EXP-{rng.randint(1000, 99999)}": rng.choice("abc") for _ in range(120)},
+        "endpoints": {
+            f"{rng.choice(WORDS)}{index}": f"/api/v1/{rng.choice(WORDS)}/" for index in range(60)
+        },
+        "locale": "pl",
+        "currency": "PLN",
+    }
+
+
+def make_head(rng: random.Random, host: str, scale: float) -> str:
+    meta = "".join(
+        f'<meta name="{name}" content="{words(rng, 8)}"/>'
+        for name in ("description", "keywords", "og:title", "og:description", "robots")
+    )
+    preloads = "".join(
+        f'<link rel="preload" href="https://{host}/_next/static/chunks/{chunk_name(rng)}.js"'
+        f' as="script"/>'
+        for _ in range(int(45 * scale))
+    )
+    config = json.dumps(json.dumps(make_config(rng)))
+    return (
+        meta
+        + '<meta name="viewport" content="width=device-width, initial-scale=1"/>'
+        + preloads
+        + f'<style data-emotion="css">{make_styles(rng, int(1400 * scale))}</style>'
+        + f"<script>window.__INIT_CONFIG__={config};</script>"
+        + f"<script>{make_bundle(rng, int(30000 * scale))}</script>"
+    )
+
+
+def make_icon_sprite(rng: random.Random, count: int) -> str:
+    icons = []
+    for index in range(count):
+        path = " ".join(
+            f"{rng.uniform(0, 24):.2f} {rng.uniform(0, 24):.2f}{rng.choice('LClcHV')}"
+            for _ in range(rng.randint(15, 40))
+        )
+        icons.append(
+            f'<symbol id="icon-{index}" viewBox="0 0 24 24"><path d="M{path}Z"></path></symbol>'
+        )
+    return f'<svg xmlns="http://www.w3.org/2000/svg" style="display:none">{"".join(icons)}</svg>'
+
+
+def make_navigation(rng: random.Random, count: int) -> str:
+    items = "".join(
+        f'<li class="{css_class(rng)}"><a href="/{rng.choice(WORDS)}/{rng.choice(WORDS)}/">'
+        f'<svg width="16" height="16"><use href="#icon-{rng.randint(0, 39)}"></use></svg>'
+        f"<span>{words(rng, 2).capitalize()}</span></a></li>"
+        for _ in range(count)
+    )
+    return f'<header class="{css_class(rng)}"><nav><ul>{items}</ul></nav></header>'
+
+
+def make_footer(rng: random.Random, count: int) -> str:
+    columns = "".join(
+        f"<div><h4>{words(rng, 2).capitalize()}</h4><ul>"
+        + "".join(
+            f'<li><a href="/{rng.choice(WORDS)}/{rng.choice(CITIES).lower()}/">'
+            f"{rng.choice(WORDS).capitalize()} {rng.choice(CITIES)}</a></li>"
+            for _ in range(count // 6)
+        )
+        + "</ul></div>"
+        for _ in range(6)
+    )
+    return f'<footer class="{css_class(rng)}">{columns}<p>{words(rng, 60)}</p></footer>'
+
+
+def make_similar_ads(rng: random.Random, site: str, count: int) -> str:
+    """
+    Carousel of similar ads, its images don't use the classes the OLX parsers look for
+    and it comes after the ad's own pictures that the Otodom parsers take the first of
+    """
+    cards = []
+    for index in range(count):
+        photo = f"https://ireland.apollo.olxcdn.com/v1/files/similar{index}/image"
+        if site == "olx":
+            image = f'<img src="{photo};s=216x152" alt="" class="css-8wsg1m" loading="lazy"/>'
+        else:
+            image = f'<picture><img src="{photo};s=300x200" alt="" loading="lazy"/></picture>'
+        cards.append(
+            f'<div data-cy="similar-ad" class="{css_class(rng)}">'
+            f'<a href="/d/oferta/{rng.choice(WORDS)}-ID{rng.randint(10**7, 10**8)}.html">'
+            f"{image}<h6>{words(rng, 6).capitalize()}</h6>"
+            f"<p>{rng.randint(15, 60) * 100} zł</p><p>{rng.choice(CITIES)}</p></a></div>"
+        )
+    return f"<section><h2>Podobne ogłoszenia</h2>{''.join(cards)}</section>"
+
+
+def make_chunk_scripts(rng: random.Random, host: str, count: int) -> str:
+    return "".join(
+        f'<script src="https://{host}/_next/static/chunks/{chunk_name(rng)}.js" defer=""></script>'
+        for _ in range(count)
+    )
+
+
+def make_categories(rng: random.Random, count: int) -> list[dict]:
+    return [
+        {
+            "id": index,
+            "name": words(rng, 2).capitalize(),
+            "parentId": rng.randint(0, index) if index else None,
+            "icon": f"icon-{rng.randint(0, 39)}",
+            "isLeaf": rng.random() < 0.7,
+            "params": [rng.choice(WORDS) for _ in range(rng.randint(0, 6))],
+        }
+        for index in range(count)
+    ]
+
+
+def make_translations(rng: random.Random, count: int) -> dict:
+    return {
+        f"{rng.choice(WORDS)}.{rng.choice(WORDS)}.{index}": words(rng, rng.randint(2, 12))
+        for index in range(count)
+    }
+
+
+def make_similar_states(rng: random.Random, ad: dict, count: int) -> list[dict]:
+    return [
+        {**ad, "id": index, "title": words(rng, 6).capitalize(), "description": words(rng, 60)}
+        for index in range(count)
+    ]
+
+
+def pad_olx_state(rng: random.Random, state: dict, scale: float) -> dict:
+    ad = state["ad"]["ad"]
+    return {
+        **state,
+        "site": make_config(rng),
+        "categories": make_categories(rng, int(400 * scale)),
+        "translations": make_translations(rng, int(1200 * scale)),
+        "similarAds": make_similar_states(rng, ad, int(24 * scale)),
+        "userAds": make_similar_states(rng, ad, int(8 * scale)),
+    }
+
+
+def pad_otodom_state(rng: random.Random, data: dict, scale: float) -> dict:
+    page_props = data["props"]["pageProps"]
+    return {
+        **data,
+        "props": {
+            **data["props"],
+            "pageProps": {
+                **page_props,
+                "translations": make_translations(rng, int(1800 * scale)),
+                "similarAds": make_similar_states(rng, page_props["ad"], int(24 * scale)),
+                "trackingData": {
+                    f"{rng.choice(WORDS)}{index}": words(rng, 2) for index in range(150)
+                },
+            },
+        },
+        "page": "/[lang]/ad/[id]",
+        "runtimeConfig": make_config(rng),
+        "locale": "pl",
+    }
+
+
+def pad_page(name: str, content: bytes, scale: float = 1) -> bytes:
+    """
+    The fixture padded to about `scale` times the size of a real page
+    """
+    rng = random.Random(f"{SEED}:{name}")
+    page = content.decode()
+    site = "olx" if name.startswith("olx") else "otodom"
+    host = f"statics.{site}.pl"
+
+    match = olx_state_pattern.search(page)
+    if match:
+        state = pad_olx_state(rng, json.loads(json.loads(match.group(1))), scale)
+        page = page[: match.start(1)] + json.dumps(json.dumps(state)) + page[match.end(1) :]
+    match = otodom_state_pattern.search(page)
+    if match:
+        data = pad_otodom_state(rng, json.loads(match.group(1)), scale)
+        page = page[: match.start(1)] + json.dumps(data, ensure_ascii=False) + page[match.end(1) :]
+
+    page = page.replace("</head>", make_head(rng, host, scale) + "</head>", 1)
+    page = page.replace(
+        "<body>", "<body>" + make_icon_sprite(rng, 40) + make_navigation(rng, int(160 * scale)), 1
+    )
+
+    if name.endswith("_listing.html"):
+        chrome = (
+            make_footer(rng, int(240 * scale))
+            + f"<script>{make_bundle(rng, int(120000 * scale))}</script>"
+        )
+    else:
+        chrome = (
+            make_similar_ads(rng, site, int(24 * scale))
+            + make_footer(rng, int(180 * scale))
+            + f"<script>{make_bundle(rng, int(60000 * scale))}</script>"
+        )
+    # Otodom's __NEXT_DATA__ comes after the page content and before the chunk scripts
+    match = otodom_state_pattern.search(page)
+    body_end = page.rindex("</body>")
+    content_end = match.start() if match else body_end
+    page = (
+        page[:content_end]
+        + chrome
+        + page[content_end:body_end]
+        + make_chunk_scripts(rng, host, int(40 * scale))
+        + page[body_end:]
+    )
+    return page.encode()
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--output", required=True, help="directory for the padded pages")
+    arg_parser.add_argument("--scale", type=float, default=1, help="size relative to real pages")
+    args = arg_parser.parse_args()
+
+    output = Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    for path in sorted(FIXTURES_DIR.glob("*.html")):
+        page = pad_page(path.name, path.read_bytes(), args.scale)
+        (output / path.name).write_bytes(page)
+        print(f"{path.name}: {len(page) // 1024} KB")
+
+
+if __name__ == "__main__":
+    main()
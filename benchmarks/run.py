@@ -0,0 +1,218 @@
+"""
+Offline benchmarks of the scraping and matching hot paths, results are printed as JSON:
+
+    PARSER_BACKEND=lxml python -m benchmarks.run --output benchmark.json
+
+Parsers run on the fixtures padded to real page size by `benchmarks.make_fixtures`
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import timeit
+from dataclasses import replace
+from datetime import date, datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable
+
+from ad import Card, OwnerType
+from benchmarks.make_fixtures import pad_page
+from http_client import Response
+from logger import logger
+from matcher import AdMatcher
+from parsers import PARSER_BACKEND, extract_cards, parse_item, parse_olx, parse_otodom
+from scraper import AD_TYPES, BUILDING_TYPES
+from utils import convert_utc_to_local
+
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+# Detail fixtures are dated this day, it's swapped for today because older ads are skipped
+FIXTURES_DATE = b"2024-11-05"
+CITIES = [
+    "warszawa",
+    "krakow",
+    "wroclaw",
+    "gdansk",
+    "poznan",
+    "lodz",
+    "katowice",
+    "lublin",
+    "szczecin",
+    "bydgoszcz",
+    "bialystok",
+    "gdynia",
+    "czestochowa",
+    "radom",
+    "torun",
+    "rzeszow",
+    "kielce",
+    "gliwice",
+    "olsztyn",
+    "opole",
+]
+
+
+def load_fixture(name: str, url: str, scale: float = 1) -> Response:
+    """
+    The fixture padded to `scale` times the size of a real page, 0 leaves it as checked in
+    """
+    content = (FIXTURES_DIR / name).read_bytes()
+    if scale:
+        content = pad_page(name, content, scale)
+    content = content.replace(FIXTURES_DATE, date.today().isoformat().encode())
+    return Response(url=url, status_code=200, content=content)
+
+
+def measure(func: Callable[[], Any], repeat: int) -> dict:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    timings = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "mean_s": statistics.mean(timings),
+    }
+
+
+def make_users(count: int, rng: random.Random) -> list[SimpleNamespace]:
+    # Mostly flats, users without a building type filter get every type
+    building_type_filters = BUILDING_TYPES + ["mieszkania"] * 6 + ["stancje-pokoje", None]
+    users = []
+    for user_id in range(1, count + 1):
+        min_price = rng.choice([None, None, 1500, 2000, 2500, 3000])
+        users.append(
+            SimpleNamespace(
+                user_id=user_id,
+                chat_id=user_id,
+                city=rng.choice(CITIES),
+                ad_type_filter=rng.choices(AD_TYPES + [None], weights=[8, 1, 1])[0],
+                building_type_filter=rng.choice(building_type_filters),
+                min_price_filter=min_price,
+                max_price_filter=rng.choice([None, (min_price or 1000) + 2000]),
+                min_surface_area_filter=rng.choice([None, None, 25, 35, 50]),
+                private_only_filter=rng.random() < 0.2,
+            )
+        )
+    return users
+
+
+def make_ads(template, count: int, rng: random.Random) -> list[tuple]:
+    ads = []
+    for i in range(count):
+        url = f"https://www.olx.pl/d/oferta/mieszkanie-CID3-ID{i}.html"
+        ad = replace(
+            template,
+            url=url,
+            canonical_url=url.replace("www.", ""),
+            price_value=rng.randrange(1200, 8000, 50),
+            area=round(rng.uniform(15, 120), 1),
+            owner_type=rng.choice(list(OwnerType)),
+        )
+        feed = (rng.choice(CITIES), rng.choice(AD_TYPES), rng.choice(BUILDING_TYPES))
+        ads.append((feed, ad))
+    return ads
+
+
+def filter_ads(matcher: AdMatcher, ads: list[tuple], seen: dict[int, set[str]]) -> int:
+    """
+    The send loop's work for one batch of ads: match them and skip the already sent ones
+    """
+    queued = 0
+    for (city, ad_type, building_type), ad in ads:
+        for user in matcher.match(city, ad_type, building_type, ad):
+            if ad.canonical_url not in seen[user.user_id]:
+                queued += 1
+    return queued
+
+
+def run_parser_benchmarks(repeat: int, scale: float) -> list[dict]:
+    olx_url = "https://www.olx.pl/d/oferta/ID1.html"
+    otodom_url = "https://www.otodom.pl/pl/oferta/ID1"
+    listing = load_fixture("olx_listing.html", "https://www.olx.pl/nieruchomosci/", scale).content
+    olx = load_fixture("olx_detail.html", olx_url, scale)
+    olx_markup = load_fixture("olx_detail_markup.html", olx_url, scale)
+    otodom = load_fixture("otodom_detail.html", otodom_url, scale)
+    otodom_markup = load_fixture("otodom_detail_markup.html", otodom_url, scale)
+
+    cases = {
+        "extract_cards": lambda: extract_cards(listing),
+        "parse_olx": lambda: parse_olx(olx),
+        "parse_olx_markup": lambda: parse_olx(olx_markup),
+        "parse_otodom": lambda: parse_otodom(otodom),
+        "parse_otodom_markup": lambda: parse_otodom(otodom_markup),
+        "parse_item": lambda: parse_item(olx),
+        "convert_utc_to_local": lambda: convert_utc_to_local("10:15"),
+    }
+    return [{"name": name, "params": {}, **measure(func, repeat)} for name, func in cases.items()]
+
+
+def run_matcher_benchmarks(user_counts: list[int], ads_count: int, repeat: int) -> list[dict]:
+    rng = random.Random(42)
+    template = parse_item(load_fixture("olx_detail.html", "https://www.olx.pl/d/oferta/ID1.html"))
+    ads = make_ads(template, ads_count, rng)
+    card = Card(url=template.url, price_value=2500, area=40)
+
+    results = []
+    for count in user_counts:
+        users = make_users(count, rng)
+        seen = {
+            user.user_id: {ad.canonical_url for _, ad in rng.sample(ads, k=min(20, ads_count))}
+            for user in users
+        }
+        matcher = AdMatcher(users)
+        params = {"users": count, "ads": ads_count, "signatures": matcher.signatures_count}
+        cases = {
+            "matcher_build": lambda: AdMatcher(users),
+            "matcher_feeds": lambda: matcher.feeds(),
+            "matcher_accepts_card": lambda: matcher.accepts_card(*ads[0][0], card),
+            "send_items_filter": lambda: filter_ads(matcher, ads, seen),
+        }
+        for name, func in cases.items():
+            results.append({"name": name, "params": params, **measure(func, repeat)})
+    return results
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--output", help="JSON file for the results, stdout by default")
+    arg_parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000])
+    arg_parser.add_argument("--ads", type=int, default=200, help="ads per send loop batch")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument(
+        "--fixture-scale",
+        type=float,
+        default=1,
+        help="size of the parsed pages relative to real ones, 0 for the unpadded fixtures",
+    )
+    args = arg_parser.parse_args()
+
+    # Parsers log every fallback, that shouldn't be measured
+    logger.disabled = True
+    results = run_parser_benchmarks(args.repeat, args.fixture_scale)
+    results += run_matcher_benchmarks(args.users, args.ads, args.repeat)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "parser_backend": PARSER_BACKEND,
+            "fixture_scale": args.fixture_scale,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
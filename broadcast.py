@@ -0,0 +1,70 @@
+import asyncio
+import os
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from dotenv import load_dotenv
+
+from db.async_broadcast_handler import save_broadcast_progress
+from db.async_user_handler import deactivate_user, get_active_users_page
+from db.config import Broadcast
+from delivery import TokenBucket
+from logger import logger
+
+
+load_dotenv()
+
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", 100))
+
+
+async def run_broadcast(bot: Bot, broadcast: Broadcast, bucket: TokenBucket) -> None:
+    """
+    Sends the broadcast to active users page by page under the shared rate limit.
+    Progress is saved after every message, so an interrupted broadcast continues after
+    the last saved user and repeats at most the message that was being sent
+    """
+    logger.info(f"Running broadcast {broadcast.id} after user {broadcast.last_user_id}")
+    try:
+        while True:
+            users = await get_active_users_page(broadcast.last_user_id, BROADCAST_PAGE_SIZE)
+            if not users:
+                break
+
+            for user in users:
+                await send_broadcast_message(bot, broadcast, user, bucket)
+                broadcast.last_user_id = user.user_id
+                # Sends are throttled anyway, a write per message costs little next to them
+                await save_broadcast_progress(broadcast)
+
+        await save_broadcast_progress(broadcast, is_finished=True)
+    except Exception as e:
+        logger.exception(f"Broadcast {broadcast.id} stopped, it will resume after restart: {e}")
+        return
+
+    logger.info(f"Broadcast {broadcast.id} finished")
+    await bot.send_message(
+        broadcast.admin_chat_id,
+        f"Broadcast finished\n"
+        f"Delivered: {broadcast.delivered}\n"
+        f"Blocked: {broadcast.blocked}\n"
+        f"Failed: {broadcast.failed}",
+    )
+
+
+async def send_broadcast_message(bot: Bot, broadcast: Broadcast, user, bucket: TokenBucket):
+    while True:
+        await bucket.acquire()
+        try:
+            await bot.send_message(user.chat_id, broadcast.text)
+            broadcast.delivered += 1
+        except TelegramRetryAfter as e:
+            logger.warning(f"Flood control during broadcast, retrying in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+            continue
+        except TelegramForbiddenError:
+            broadcast.blocked += 1
+            await deactivate_user(user.user_id)
+        except Exception as e:
+            logger.warning(f"Error during broadcasting to user {user.user_id}: {e}")
+            broadcast.failed += 1
+        return
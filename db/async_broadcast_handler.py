@@ -0,0 +1,43 @@
+from sqlalchemy import select, update
+
+from db.config import AsyncSessionLocal, Broadcast
+
+
+async def create_broadcast(admin_chat_id: int, text: str) -> Broadcast:
+    async with AsyncSessionLocal() as session:
+        broadcast = Broadcast(
+            admin_chat_id=admin_chat_id,
+            text=text,
+            is_finished=False,
+            delivered=0,
+            blocked=0,
+            failed=0,
+        )
+        session.add(broadcast)
+        await session.commit()
+        await session.refresh(broadcast)
+        return broadcast
+
+
+async def get_unfinished_broadcasts() -> list[Broadcast]:
+    async with AsyncSessionLocal() as session:
+        broadcasts = await session.scalars(
+            select(Broadcast).where(Broadcast.is_finished == False).order_by(Broadcast.id)
+        )
+        return list(broadcasts)
+
+
+async def save_broadcast_progress(broadcast: Broadcast, is_finished: bool = False) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast.id)
+            .values(
+                last_user_id=broadcast.last_user_id,
+                delivered=broadcast.delivered,
+                blocked=broadcast.blocked,
+                failed=broadcast.failed,
+                is_finished=is_finished,
+            )
+        )
+        await session.commit()
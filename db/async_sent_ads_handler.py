@@ -0,0 +1,51 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Iterable
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import delete, insert, select
+
+from db.config import AsyncSessionLocal, SentAd
+
+
+async def write_ad(user_id: int, olx_link: str) -> SentAd:
+    async with AsyncSessionLocal() as session:
+        ad = SentAd(user_id=user_id, olx_link=olx_link)
+        session.add(ad)
+        await session.commit()
+        await session.refresh(ad)
+        return ad
+
+
+async def write_ads(records: list[dict]) -> None:
+    """
+    Inserts many `{"user_id", "olx_link", "timestamp"}` records in one transaction
+    """
+    async with AsyncSessionLocal() as session:
+        await session.execute(insert(SentAd), records)
+        await session.commit()
+
+
+async def filter_ads(user_id: int) -> list[str]:
+    async with AsyncSessionLocal() as session:
+        links = await session.scalars(select(SentAd.olx_link).where(SentAd.user_id == user_id))
+        return list(links)
+
+
+async def get_sent_links(user_ids: Iterable[int]) -> dict[int, set[str]]:
+    async with AsyncSessionLocal() as session:
+        rows = await session.execute(
+            select(SentAd.user_id, SentAd.olx_link).where(SentAd.user_id.in_(list(user_ids)))
+        )
+
+        links = defaultdict(set)
+        for user_id, olx_link in rows:
+            links[user_id].add(olx_link)
+        return links
+
+
+async def delete_old_records() -> None:
+    async with AsyncSessionLocal() as session:
+        timestamp_threshold = datetime.now(tz=timezone.utc) - relativedelta(months=1)
+        await session.execute(delete(SentAd).where(SentAd.timestamp < timestamp_threshold))
+        await session.commit()
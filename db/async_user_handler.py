@@ -0,0 +1,114 @@
+from sqlalchemy import delete, select, update
+
+from db.config import AsyncSessionLocal, User
+
+
+async def get_user(user_id: int):
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(User).where(User.user_id == user_id))
+
+
+async def get_user_by_chat_id(chat_id: int):
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(User).where(User.chat_id == chat_id))
+
+
+async def get_all_users():
+    async with AsyncSessionLocal() as session:
+        return (await session.scalars(select(User))).all()
+
+
+async def get_all_active_users_with_city():
+    async with AsyncSessionLocal() as session:
+        users = await session.scalars(
+            select(User).where(User.city.isnot(None), User.is_active == True, User.is_bot == False)
+        )
+        return users.all()
+
+
+async def get_active_users_page(after_user_id: int | None, limit: int):
+    """
+    Active users ordered by user_id, starting after `after_user_id`
+    """
+    async with AsyncSessionLocal() as session:
+        query = select(User).where(User.is_active == True, User.is_bot == False)
+        if after_user_id is not None:
+            query = query.where(User.user_id > after_user_id)
+        users = await session.scalars(query.order_by(User.user_id).limit(limit))
+        return users.all()
+
+
+async def write_user(
+    user_id: int,
+    chat_id: int,
+    full_name: str,
+    username: str,
+    is_bot: bool,
+    city: str | None = None,
+):
+    async with AsyncSessionLocal() as session:
+        user = User(
+            user_id=user_id,
+            chat_id=chat_id,
+            full_name=full_name,
+            username=username,
+            is_bot=is_bot,
+            city=city,
+            is_active=True,
+        )
+        session.add(user)
+        await session.commit()
+        await session.refresh(user)
+        return user
+
+
+async def delete_user(user_id: int):
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(User).where(User.user_id == user_id))
+        await session.commit()
+
+
+async def activate_user(user_id: int):
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(User).where(User.user_id == user_id).values(is_active=True))
+        await session.commit()
+
+
+async def deactivate_user(user_id: int):
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(User).where(User.user_id == user_id).values(is_active=False))
+        await session.commit()
+
+
+async def update_user_city(user_id: int, new_city: str):
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(User).where(User.user_id == user_id).values(city=new_city))
+        await session.commit()
+
+
+async def update_user_filter(user_id: int, filter_type: str, value: str):
+    if filter_type not in User.__table__.columns.keys():
+        raise ValueError(f"Incorrect filter type: {filter_type}")
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(User).where(User.user_id == user_id).values({filter_type: value})
+        )
+        await session.commit()
+
+
+async def get_unique_cities():
+    async with AsyncSessionLocal() as session:
+        cities = await session.execute(
+            select(User.city).where(User.city.isnot(None), User.is_active == True).distinct()
+        )
+        return set(city for (city,) in cities if city)
+
+
+async def get_unique_building_types():
+    async with AsyncSessionLocal() as session:
+        building_types = await session.execute(
+            select(User.building_type_filter)
+            .where(User.building_type_filter.isnot(None), User.is_active == True)
+            .distinct()
+        )
+        return list(building_type for (building_type,) in building_types if building_type)
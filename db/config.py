@@ -1,13 +1,72 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, Column, Integer, String, Boolean, DateTime, Index
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime, timezone
 
 
-DATABASE_URL = "sqlite:///db.sqlite"
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///db.sqlite")
+ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL", DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+)
+
+# SQLite profile: WAL lets handler reads run while the scheduler writes,
+# NORMAL sync is durable enough in WAL mode and avoids an fsync per commit
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", -64000))  # negative value is in KiB
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))  # ms
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+if DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(
+        DATABASE_URL,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT / 1000},
+    )
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+else:
+    engine = create_engine(
+        DATABASE_URL, echo=False, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW
+    )
+
+if ASYNC_DATABASE_URL.startswith("sqlite"):
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        connect_args={"timeout": SQLITE_BUSY_TIMEOUT / 1000},
+    )
+    event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+else:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, echo=False, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW
+    )
 
-engine = create_engine(DATABASE_URL, echo=False)
 SessionLocal = sessionmaker(bind=engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -35,6 +94,21 @@ class SentAd(Base):
     user_id = Column(Integer, nullable=False)
     olx_link = Column(String, nullable=False)
 
+    __table_args__ = (Index("ix_sent_ads_user_id_olx_link", "user_id", "olx_link"),)
+
+
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+    id = Column(Integer, primary_key=True, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    admin_chat_id = Column(Integer, nullable=False)
+    text = Column(String, nullable=False)
+    is_finished = Column(Boolean, nullable=False, default=False)
+    last_user_id = Column(Integer, nullable=True)
+    delivered = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+
 
 # Create tables (for development only; use Alembic for migrations in production)
 if __name__ == "__main__":
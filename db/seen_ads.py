@@ -0,0 +1,94 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import Iterable
+
+from dotenv import load_dotenv
+
+from db.async_sent_ads_handler import get_sent_links, write_ads
+from logger import logger
+
+
+load_dotenv()
+
+SENT_ADS_FLUSH_SIZE = int(os.getenv("SENT_ADS_FLUSH_SIZE", 100))
+SENT_ADS_FLUSH_INTERVAL = float(os.getenv("SENT_ADS_FLUSH_INTERVAL", 5))
+
+
+class SeenAds:
+    """
+    Warm per-user sets of already sent links, so deduplication is a set lookup
+    instead of loading the user's whole history for every ad.
+    Sent links are written to the DB in batches, pending ones already count as seen
+    """
+
+    def __init__(self, flush_size: int, flush_interval: float):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._links: dict[int, set[str]] = {}
+        self._pending: list[dict] = []
+        self._flush_task: asyncio.Task | None = None
+
+    async def load(self, user_ids: Iterable[int]) -> None:
+        """
+        Loads history of users that aren't warm yet and drops users that aren't passed
+        """
+        user_ids = set(user_ids)
+        for user_id in set(self._links) - user_ids:
+            del self._links[user_id]
+
+        missing_user_ids = user_ids - set(self._links)
+        if missing_user_ids:
+            sent_links = await get_sent_links(missing_user_ids)
+            for user_id in missing_user_ids:
+                self._links[user_id] = sent_links.get(user_id, set()) | self._pending_links(user_id)
+
+    async def is_seen(self, user_id: int, *olx_links: str) -> bool:
+        if user_id not in self._links:
+            await self.load([*self._links, user_id])
+        return any(olx_link in self._links[user_id] for olx_link in olx_links)
+
+    async def mark(self, user_id: int, olx_link: str) -> None:
+        self._links.setdefault(user_id, set()).add(olx_link)
+        self._pending.append(
+            {"user_id": user_id, "olx_link": olx_link, "timestamp": datetime.now(timezone.utc)}
+        )
+        # Marking runs on the delivery path, so a full batch is written in the background,
+        # the interval flushes are up to `run_flusher`
+        if len(self._pending) >= self.flush_size and (
+            self._flush_task is None or self._flush_task.done()
+        ):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+
+        records, self._pending = self._pending, []
+        try:
+            await write_ads(records)
+        except Exception as e:
+            logger.exception(f"Error during saving {len(records)} sent ads, will retry: {e}")
+            self._pending = records + self._pending
+
+    async def drain(self) -> None:
+        """
+        Waits for a background flush and writes what's still pending
+        """
+        if self._flush_task is not None:
+            await self._flush_task
+        await self.flush()
+
+    async def run_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def clear(self) -> None:
+        self._links.clear()
+
+    def _pending_links(self, user_id: int) -> set[str]:
+        return {record["olx_link"] for record in self._pending if record["user_id"] == user_id}
+
+
+seen_ads = SeenAds(SENT_ADS_FLUSH_SIZE, SENT_ADS_FLUSH_INTERVAL)
@@ -0,0 +1,250 @@
+import asyncio
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from math import inf
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InputMediaPhoto
+from dotenv import load_dotenv
+
+from ad import Ad
+from cache import TTLCache
+from logger import logger
+from metrics import ads_deduped, ads_sent, send_seconds
+from parsers import image_placeholder
+
+
+load_dotenv()
+
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", 8))
+# Telegram allows ~30 messages per second overall and ~1 per second in a single chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 25))
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", 1.0))
+DELIVERY_MAX_RETRIES = int(os.getenv("DELIVERY_MAX_RETRIES", 3))
+# Several pending ads for a chat are sent as one album of up to 10 photos
+DELIVERY_MEDIA_GROUPS = os.getenv("DELIVERY_MEDIA_GROUPS", "false").lower() == "true"
+MEDIA_GROUP_SIZE = 10
+# Telegram's file_id of an already sent image is reused for the next recipients,
+# so Telegram doesn't download it from OLX again
+FILE_ID_CACHE_SIZE = int(os.getenv("FILE_ID_CACHE_SIZE", 10000))
+FILE_ID_CACHE_TTL = float(os.getenv("FILE_ID_CACHE_TTL", os.getenv("AD_CACHE_TTL", 6 * 60 * 60)))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class Delivery:
+    user_id: int
+    chat_id: int
+    ad: Ad
+    attempts: int = 0
+    groupable: bool = True
+    city: str | None = None
+
+
+class DeliveryQueue:
+    """
+    Per-chat FIFO queues served round-robin by worker coroutines, so one chat with many ads
+    doesn't delay other chats. Sends go through a global token bucket, every chat is paced
+    separately and Telegram's RetryAfter is honored
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        on_sent: Callable[[Delivery], Awaitable[None]],
+        workers: int = DELIVERY_WORKERS,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_interval: float = TELEGRAM_CHAT_INTERVAL,
+        max_retries: int = DELIVERY_MAX_RETRIES,
+        media_groups: bool = DELIVERY_MEDIA_GROUPS,
+    ):
+        self.bot = bot
+        self.on_sent = on_sent
+        self.workers = workers
+        self.bucket = TokenBucket(global_rate)
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.media_groups = media_groups
+        self.file_ids = TTLCache(maxsize=FILE_ID_CACHE_SIZE, ttl=FILE_ID_CACHE_TTL)
+
+        self._queues: dict[int, deque[Delivery]] = {}
+        self._ready: deque[int] = deque()
+        self._in_flight: set[int] = set()
+        self._pending: set[tuple[int, str]] = set()
+        self._next_allowed: dict[int, float] = {}
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def put(self, delivery: Delivery) -> bool:
+        key = (delivery.chat_id, delivery.ad.canonical_url)
+        if key in self._pending:
+            ads_deduped.inc()
+            return False
+
+        self._pending.add(key)
+        self._queues.setdefault(delivery.chat_id, deque()).append(delivery)
+        if delivery.chat_id not in self._in_flight and delivery.chat_id not in self._ready:
+            self._ready.append(delivery.chat_id)
+        self._wakeup.set()
+        return True
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def is_pending(self, delivery: Delivery) -> bool:
+        """
+        Whether the delivery is still queued or retried, not yet sent, dropped or given up on
+        """
+        return (delivery.chat_id, delivery.ad.canonical_url) in self._pending
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _next_chat(self) -> int:
+        while True:
+            now = time.monotonic()
+            for _ in range(len(self._ready)):
+                chat_id = self._ready.popleft()
+                if self._next_allowed.get(chat_id, 0) <= now:
+                    self._in_flight.add(chat_id)
+                    return chat_id
+                self._ready.append(chat_id)
+
+            delay = min(
+                (self._next_allowed[chat_id] - now for chat_id in self._ready), default=None
+            )
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._next_chat()
+            queue = self._queues[chat_id]
+            batch = self._take_batch(queue)
+            try:
+                await self.bucket.acquire()
+                await self._send(chat_id, batch)
+                ads_sent.inc(len(batch))
+                for delivery in batch:
+                    self._pending.discard((chat_id, delivery.ad.canonical_url))
+                    await self._notify_sent(delivery)
+
+            except TelegramRetryAfter as e:
+                logger.warning(f"Flood control for chat {chat_id}, retrying in {e.retry_after}s")
+                queue.extendleft(reversed(batch))
+                self._next_allowed[chat_id] = time.monotonic() + e.retry_after
+
+            except TelegramForbiddenError as e:
+                logger.warning(f"Dropping {len(batch) + len(queue)} ads for chat {chat_id}: {e}")
+                for dropped in (*batch, *queue):
+                    self._pending.discard((chat_id, dropped.ad.canonical_url))
+                queue.clear()
+
+            except Exception as e:
+                logger.warning(f"Error during sending {len(batch)} ads to chat {chat_id}: {e}")
+                for delivery in batch:
+                    delivery.attempts += 1
+                    # One broken image fails the whole album, so retry its ads one by one
+                    delivery.groupable = False
+                    if delivery.attempts < self.max_retries:
+                        queue.append(delivery)
+                    else:
+                        logger.error(f"Giving up sending {delivery.ad.url} to chat {chat_id}: {e}")
+                        self._pending.discard((chat_id, delivery.ad.canonical_url))
+
+            finally:
+                self._in_flight.discard(chat_id)
+                self._next_allowed[chat_id] = max(
+                    self._next_allowed.get(chat_id, 0), time.monotonic() + self.chat_interval
+                )
+                if queue:
+                    self._ready.append(chat_id)
+                else:
+                    del self._queues[chat_id]
+                self._wakeup.set()
+
+    def _take_batch(self, queue: deque[Delivery]) -> list[Delivery]:
+        batch = [queue.popleft()]
+        if self.media_groups and batch[0].groupable:
+            while queue and queue[0].groupable and len(batch) < MEDIA_GROUP_SIZE:
+                batch.append(queue.popleft())
+        return batch
+
+    async def _notify_sent(self, delivery: Delivery) -> None:
+        try:
+            await self.on_sent(delivery)
+        except Exception as e:
+            logger.exception(f"Error during handling sent ad {delivery.ad.url}: {e}")
+
+    async def _send(self, chat_id: int, batch: list[Delivery]) -> None:
+        try:
+            if len(batch) == 1:
+                with send_seconds.time(method="send_photo"):
+                    message = await self.bot.send_photo(
+                        chat_id=chat_id,
+                        photo=self.file_ids.get(batch[0].ad.image, batch[0].ad.image),
+                        caption=batch[0].ad.caption,
+                    )
+                messages = [message]
+            else:
+                with send_seconds.time(method="send_media_group"):
+                    messages = await self.bot.send_media_group(
+                        chat_id=chat_id,
+                        media=[
+                            InputMediaPhoto(
+                                media=self.file_ids.get(delivery.ad.image, delivery.ad.image),
+                                caption=delivery.ad.caption,
+                            )
+                            for delivery in batch
+                        ],
+                    )
+        except TelegramRetryAfter:
+            raise
+        except Exception:
+            # The cached file_id may have been the problem, next attempt uploads by URL
+            for delivery in batch:
+                self.file_ids.pop(delivery.ad.image)
+            raise
+
+        for delivery, message in zip(batch, messages):
+            if message.photo and delivery.ad.image not in self.file_ids:
+                self.file_ids.set(
+                    delivery.ad.image,
+                    message.photo[-1].file_id,
+                    ttl=inf if delivery.ad.image == image_placeholder else None,
+                )
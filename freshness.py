@@ -0,0 +1,160 @@
+import html
+import math
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from ad import Ad
+from metrics import Histogram
+
+
+load_dotenv()
+
+FRESHNESS_RELATIVE_ACCURACY = float(os.getenv("FRESHNESS_RELATIVE_ACCURACY", 0.01))
+THROUGHPUT_WINDOW = float(os.getenv("THROUGHPUT_WINDOW", 5 * 60))
+POLL_DURATIONS_SIZE = 100
+
+ad_freshness_seconds = Histogram(
+    "rent_finder_ad_freshness_seconds",
+    "Time from an ad's publication to its delivery",
+    buckets=(30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 21600),
+)
+
+
+class QuantileSketch:
+    """
+    Counts of values in logarithmic buckets, so any quantile is known within
+    `relative_accuracy` of the exact one in constant memory. Values below `min_value`
+    are counted as `min_value`
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1.0):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.min_value = min_value
+        self.count = 0
+        self._log_gamma = math.log(self.gamma)
+        self._buckets: dict[int, int] = {}
+
+    def add(self, value: float) -> None:
+        index = math.ceil(math.log(max(value, self.min_value)) / self._log_gamma)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen > rank:
+                return 2 * self.gamma**index / (self.gamma + 1)
+        return None
+
+
+class FreshnessStats:
+    """
+    Per-city sketches of how long ads take from publication to scraping and to delivery,
+    plus the poll durations and the delivery throughput for the admin's /stats
+    """
+
+    def __init__(self, relative_accuracy: float, throughput_window: float):
+        self.relative_accuracy = relative_accuracy
+        self.throughput_window = throughput_window
+        self.started_at = datetime.now().astimezone()
+        self.sent_count = 0
+        self._scraped: dict[str, QuantileSketch] = {}
+        self._delivered: dict[str, QuantileSketch] = {}
+        self._poll_durations: deque[float] = deque(maxlen=POLL_DURATIONS_SIZE)
+        self._sent_at: deque[float] = deque()
+
+    def record_delivery(self, city: str | None, ad: Ad) -> None:
+        now = time.time()
+        self.sent_count += 1
+        self._sent_at.append(now)
+        self._trim_sent_at(now)
+        if not ad.published_at:
+            return
+
+        published_at = datetime.fromisoformat(ad.published_at).timestamp()
+        # OLX's "HH:MM" is taken as today's, so an ad from just before midnight parsed
+        # after it seems to come from the future, such gaps would skew the quantiles down
+        if now - published_at < 0:
+            return
+
+        ad_freshness_seconds.observe(now - published_at)
+        city = city or "unknown"
+        self._sketch(self._delivered, city).add(now - published_at)
+        if ad.scraped_at and ad.scraped_at - published_at >= 0:
+            self._sketch(self._scraped, city).add(ad.scraped_at - published_at)
+
+    def record_poll(self, duration: float) -> None:
+        self._poll_durations.append(duration)
+
+    def throughput(self) -> float:
+        """
+        Ads sent per second over the throughput window
+        """
+        self._trim_sent_at(time.time())
+        return len(self._sent_at) / self.throughput_window
+
+    def report(self) -> str:
+        lines = [
+            f"<b>Freshness since {self.started_at:%Y-%m-%d %H:%M}</b>",
+            "p50 / p95 from publication to scraping → to delivery",
+        ]
+        for city in sorted(self._delivered):
+            delivered = self._delivered[city]
+            scraped = self._scraped.get(city)
+            lines.append(
+                f"{html.escape(city.capitalize())}: "
+                f"{self._percentiles(scraped)} → {self._percentiles(delivered)} "
+                f"({delivered.count} ads)"
+            )
+        if not self._delivered:
+            lines.append("No ads were delivered yet")
+
+        lines.append("")
+        if self._poll_durations:
+            durations = sorted(self._poll_durations)
+            lines.append(
+                f"Feeds poll: {format_duration(self._poll_durations[-1])} last, "
+                f"{format_duration(durations[len(durations) // 2])} median "
+                f"of {len(durations)}"
+            )
+        lines.append(
+            f"Throughput: {self.throughput():.2f} ads/s over the last "
+            f"{format_duration(self.throughput_window)}, {self.sent_count} ads sent in total"
+        )
+        return "\n".join(lines)
+
+    def _sketch(self, sketches: dict[str, QuantileSketch], city: str) -> QuantileSketch:
+        if city not in sketches:
+            sketches[city] = QuantileSketch(self.relative_accuracy)
+        return sketches[city]
+
+    def _trim_sent_at(self, now: float) -> None:
+        while self._sent_at and self._sent_at[0] < now - self.throughput_window:
+            self._sent_at.popleft()
+
+    @staticmethod
+    def _percentiles(sketch: QuantileSketch | None) -> str:
+        if sketch is None or not sketch.count:
+            return "N/A"
+        return f"{format_duration(sketch.quantile(0.5))} / {format_duration(sketch.quantile(0.95))}"
+
+
+def format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    seconds = round(seconds)
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+
+
+freshness_stats = FreshnessStats(FRESHNESS_RELATIVE_ACCURACY, THROUGHPUT_WINDOW)
@@ -0,0 +1,80 @@
+import os
+from dataclasses import dataclass
+
+import aiohttp
+from dotenv import load_dotenv
+
+from metrics import http_responses
+
+
+load_dotenv()
+
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", 30))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", 100))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 20))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+
+headers = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/131.0.0.0 Safari/537.36"
+}
+
+_session: aiohttp.ClientSession | None = None
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, response: "Response"):
+        super().__init__(f"{response.status_code} response from {response.url}")
+        self.response = response
+
+
+@dataclass
+class Response:
+    url: str
+    status_code: int
+    content: bytes
+
+    def raise_for_status(self) -> None:
+        if not 200 <= self.status_code < 300:
+            raise HTTPStatusError(self)
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Returns the process-wide session, so all requests share keep-alive connections
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_LIMIT,
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TOTAL_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+    return _session
+
+
+async def fetch(url: str) -> Response:
+    try:
+        async with get_session().get(url) as response:
+            content = await response.read()
+    except Exception as e:
+        http_responses.inc(status=type(e).__name__)
+        raise
+
+    http_responses.inc(status=response.status)
+    return Response(url=str(response.url), status_code=response.status, content=content)
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -0,0 +1,235 @@
+"""
+End-to-end load test of the send loop against local OLX and Bot API stand-ins,
+the report is printed as JSON:
+
+    python -m loadtest.run --users 5000 --cities 20 --cycles 3 --latency 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from loadtest.stubs import Faults, OlxStub, TelegramStub, bound_url, start
+
+
+CITIES = [
+    "warszawa",
+    "krakow",
+    "wroclaw",
+    "gdansk",
+    "poznan",
+    "lodz",
+    "katowice",
+    "lublin",
+    "szczecin",
+    "bydgoszcz",
+    "bialystok",
+    "gdynia",
+    "czestochowa",
+    "radom",
+    "torun",
+    "rzeszow",
+    "kielce",
+    "gliwice",
+    "olsztyn",
+    "opole",
+]
+
+
+def configure(olx_url: str, telegram_url: str, db_path: Path) -> None:
+    """
+    Points the bot at the stand-ins, must run before the bot's modules are imported
+    """
+    os.environ.update(
+        {
+            "ENVIRONMENT": "production",
+            "PROD_API_TOKEN": "123456:LOADTEST",
+            "ADMIN_ID": "1",
+            "OLX_URL": f"{olx_url}/nieruchomosci/{{building_type}}/{{ad_type}}/{{city}}/"
+            "?search%5Border%5D=created_at:desc",
+            "OTODOM_URL": f"{olx_url}/otodom",
+            "TELEGRAM_API_URL": telegram_url,
+            "DATABASE_URL": f"sqlite:///{db_path}",
+            "ASYNC_DATABASE_URL": f"sqlite+aiosqlite:///{db_path}",
+        }
+    )
+
+
+def seed_users(users_count: int, cities_count: int, seed: int) -> None:
+    from db.config import Base, SessionLocal, User, engine
+
+    rng = random.Random(seed)
+    cities = [
+        CITIES[i] if i < len(CITIES) else f"{CITIES[i % len(CITIES)]}-{i // len(CITIES)}"
+        for i in range(cities_count)
+    ]
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        for user_id in range(1, users_count + 1):
+            min_price = rng.choice([None, None, 2000, 2500, 3000])
+            session.add(
+                User(
+                    user_id=user_id,
+                    chat_id=user_id,
+                    full_name=f"User {user_id}",
+                    username=f"user{user_id}",
+                    is_bot=False,
+                    city=rng.choice(cities),
+                    is_active=True,
+                    ad_type_filter=rng.choices(["wynajem", "sprzedaz", None], [8, 1, 1])[0],
+                    building_type_filter=rng.choices(
+                        ["mieszkania", "domy", "stancje-pokoje", None], [12, 2, 3, 1]
+                    )[0],
+                    min_price_filter=min_price,
+                    max_price_filter=rng.choice([None, (min_price or 1500) + 2500]),
+                    min_surface_area_filter=rng.choice([None, None, 30, 45]),
+                    private_only_filter=rng.random() < 0.2,
+                )
+            )
+        session.commit()
+
+
+async def run_cycle(olx: OlxStub, telegram: TelegramStub) -> dict:
+    """
+    One pass over every demanded feed, like the scheduler does when all of them are due
+    """
+    import main
+    from db.seen_ads import seen_ads
+    from matcher import AdMatcher
+
+    olx_requests = olx.stats.requests.copy()
+    telegram_requests = telegram.stats.requests.copy()
+    telegram_throttled = telegram.stats.throttled.copy()
+    messages_sent = telegram.stats.messages_sent
+    stages = {}
+
+    cycle_started_at = time.perf_counter()
+    started_at = time.perf_counter()
+    users = await main.load_users()
+    stages["load_users"] = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    matcher = AdMatcher([user for user in users if user.city])
+    feeds = matcher.feeds()
+    stages["build_matcher"] = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(main.poll_feed(feed, matcher) for feed in feeds))
+    stages["poll_feeds"] = time.perf_counter() - started_at
+    pending = len(main.delivery_queue)
+
+    started_at = time.perf_counter()
+    while len(main.delivery_queue):
+        await asyncio.sleep(0.05)
+    stages["deliver"] = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    await seen_ads.drain()
+    stages["flush_sent_ads"] = time.perf_counter() - started_at
+
+    return {
+        "wall_time": time.perf_counter() - cycle_started_at,
+        "stages": stages,
+        "users": len(users),
+        "feeds": len(feeds),
+        "pending_after_poll": pending,
+        "messages_sent": telegram.stats.messages_sent - messages_sent,
+        "olx_requests": dict(olx.stats.requests - olx_requests),
+        "telegram_requests": dict(telegram.stats.requests - telegram_requests),
+        "telegram_throttled": dict(telegram.stats.throttled - telegram_throttled),
+    }
+
+
+async def run(args: argparse.Namespace, db_path: Path) -> dict:
+    olx = OlxStub(
+        Faults(args.latency, args.error_rate, args.throttle_rate),
+        initial_ads=args.initial_ads,
+        new_ads=args.new_ads,
+        seed=args.seed,
+    )
+    telegram = TelegramStub(
+        Faults(args.bot_latency, args.bot_error_rate, args.bot_throttle_rate),
+        global_rate=args.bot_rate,
+        seed=args.seed,
+    )
+    olx_runner = await start(olx.app())
+    telegram_runner = await start(telegram.app())
+    olx.base_url = bound_url(olx_runner)
+    configure(olx.base_url, bound_url(telegram_runner), db_path)
+    seed_users(args.users, args.cities, args.seed)
+
+    import main
+    from db.config import async_engine
+    from http_client import close_session
+    from logger import logger
+    from parsers import shutdown_pool
+
+    logger.setLevel(args.log_level)
+    cycles = []
+    main.delivery_queue.start()
+    try:
+        for cycle in range(args.cycles):
+            if cycle:
+                olx.advance()
+            cycles.append(await run_cycle(olx, telegram))
+    finally:
+        await main.delivery_queue.stop()
+        await main.bot.session.close()
+        await close_session()
+        await async_engine.dispose()
+        shutdown_pool()
+        await olx_runner.cleanup()
+        await telegram_runner.cleanup()
+
+    return {
+        "config": vars(args),
+        "cycles": cycles,
+        "totals": {
+            "olx": olx.stats.as_dict(),
+            "telegram": telegram.stats.as_dict(),
+        },
+    }
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--users", type=int, default=1000)
+    arg_parser.add_argument("--cities", type=int, default=10)
+    arg_parser.add_argument("--cycles", type=int, default=2, help="the first one is cold")
+    arg_parser.add_argument("--initial-ads", type=int, default=200, help="ads per feed")
+    arg_parser.add_argument("--new-ads", type=int, default=3, help="new ads per feed per cycle")
+    arg_parser.add_argument("--latency", type=float, default=0.1, help="OLX mean latency, s")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0)
+    arg_parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of 429s")
+    arg_parser.add_argument("--bot-latency", type=float, default=0.05)
+    arg_parser.add_argument("--bot-error-rate", type=float, default=0.0)
+    arg_parser.add_argument("--bot-throttle-rate", type=float, default=0.0)
+    arg_parser.add_argument("--bot-rate", type=float, default=30, help="messages per second")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument(
+        "--db", type=Path, help="new SQLite file to keep, a temporary one by default"
+    )
+    arg_parser.add_argument(
+        "--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"]
+    )
+    arg_parser.add_argument("--output", help="JSON file for the report, stdout by default")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = asyncio.run(run(args, args.db or Path(tmp_dir) / "loadtest.sqlite"))
+
+    report["config"]["db"] = str(report["config"]["db"]) if args.db else None
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+
+LISTING_PAGE_SIZE = 40
+OTODOM_SHARE = 7  # every 7th card links to Otodom, like on real listings
+
+
+@dataclass
+class Faults:
+    latency: float = 0.05  # mean seconds, exponentially distributed
+    error_rate: float = 0.0  # share of 500 responses
+    throttle_rate: float = 0.0  # share of 429 responses on top of the rate limits
+
+
+@dataclass
+class Stats:
+    requests: Counter = field(default_factory=Counter)
+    errors: Counter = field(default_factory=Counter)
+    throttled: Counter = field(default_factory=Counter)
+    messages_sent: int = 0
+    photos_sent: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": dict(self.requests),
+            "errors": dict(self.errors),
+            "throttled": dict(self.throttled),
+            "messages_sent": self.messages_sent,
+            "photos_sent": self.photos_sent,
+        }
+
+
+class Stub:
+    def __init__(self, faults: Faults, seed: int = 0):
+        self.faults = faults
+        self.stats = Stats()
+        self.random = random.Random(seed)
+
+    async def respond(self, kind: str) -> web.Response | None:
+        """
+        Counts the request, waits for the simulated latency and returns an injected fault if any
+        """
+        self.stats.requests[kind] += 1
+        if self.faults.latency:
+            await asyncio.sleep(self.random.expovariate(1 / self.faults.latency))
+
+        response = self.fault()
+        if response is not None and response.status == 429:
+            self.stats.throttled[kind] += 1
+        elif response is not None:
+            self.stats.errors[kind] += 1
+        return response
+
+    def fault(self) -> web.Response | None:
+        if self.random.random() < self.faults.error_rate:
+            return self.error()
+        if self.random.random() < self.faults.throttle_rate:
+            return self.throttle()
+        return None
+
+    def error(self) -> web.Response:
+        return web.Response(status=500, text="Internal Server Error")
+
+    def throttle(self) -> web.Response:
+        return web.Response(status=429, text="Too Many Requests")
+
+
+class OlxStub(Stub):
+    """
+    Serves OLX listings and OLX/Otodom detail pages. Every feed starts with
+    `initial_ads` ads and gets `new_ads` more on every `advance()`
+    """
+
+    def __init__(self, faults: Faults, initial_ads: int = 200, new_ads: int = 2, seed: int = 0):
+        super().__init__(faults, seed)
+        self.initial_ads = initial_ads
+        self.new_ads = new_ads
+        self.base_url = ""
+        self._feeds: dict[tuple[str, str, str], int] = {}
+        self._feed_ids: dict[tuple[str, str, str], int] = {}
+
+    def advance(self) -> None:
+        for feed in self._feeds:
+            self._feeds[feed] += self.new_ads
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/nieruchomosci/{building_type}/{ad_type}/{city}/", self.listing)
+        app.router.add_get("/d/oferta/{slug}", self.olx_detail)
+        app.router.add_get("/otodom/pl/oferta/{slug}", self.otodom_detail)
+        return app
+
+    async def listing(self, request: web.Request) -> web.Response:
+        if (response := await self.respond("listing")) is not None:
+            return response
+
+        info = request.match_info
+        feed = (info["city"], info["ad_type"], info["building_type"])
+        latest = self._feeds.setdefault(feed, self.initial_ads)
+        page = int(request.query.get("page", 1))
+        first = latest - (page - 1) * LISTING_PAGE_SIZE
+        cards = "".join(
+            self.card(feed, number)
+            for number in range(first, max(first - LISTING_PAGE_SIZE, 0), -1)
+        )
+        return web.Response(
+            text=f"<html><body><div data-testid='listing-grid'>{cards}</div></body></html>",
+            content_type="text/html",
+        )
+
+    def card(self, feed: tuple[str, str, str], number: int) -> str:
+        city, ad_type, building_type = feed
+        ad_id = self.ad_id(feed, number)
+        price, area = self.ad_values(ad_id)
+        if ad_id % OTODOM_SHARE == 0:
+            href = f"{self.base_url}/otodom/pl/oferta/{building_type}-{city}-ID{ad_id}"
+        else:
+            href = f"/d/oferta/{building_type}-{city}-CID3-ID{ad_id}.html"
+        return (
+            f'<div data-cy="l-card" data-testid="l-card" id="{ad_id}"><a href="{href}">'
+            f'<img src="{self.base_url}/img/{ad_id}.jpg"/></a><h4>{ad_type} {ad_id}</h4>'
+            f'<p data-testid="ad-price">{price} zł</p>'
+            f'<p data-testid="location-date">{city} - Dzisiaj o 12:00</p>'
+            f"<span>{area} m²</span></div>"
+        )
+
+    def ad_id(self, feed: tuple[str, str, str], number: int) -> int:
+        feed_id = self._feed_ids.setdefault(feed, len(self._feed_ids) + 1)
+        return feed_id * 1000000 + number
+
+    @staticmethod
+    def ad_values(ad_id: int) -> tuple[int, int]:
+        return 1500 + ad_id * 37 % 60 * 100, 20 + ad_id * 13 % 80
+
+    async def olx_detail(self, request: web.Request) -> web.Response:
+        if (response := await self.respond("olx_detail")) is not None:
+            return response
+
+        ad_id = int(request.match_info["slug"].rsplit("-ID", 1)[1].removesuffix(".html"))
+        price, area = self.ad_values(ad_id)
+        state = {
+            "ad": {
+                "ad": {
+                    "id": ad_id,
+                    "title": f"Mieszkanie {ad_id}",
+                    "createdTime": datetime.now(timezone.utc).isoformat(),
+                    "isBusiness": ad_id % 3 == 0,
+                    "price": {"displayValue": f"{price} zł", "regularPrice": {"value": price}},
+                    "params": [
+                        {
+                            "key": "m",
+                            "name": "Powierzchnia",
+                            "value": f"{area} m²",
+                            "normalizedValue": str(area),
+                        },
+                        {
+                            "key": "floor_select",
+                            "name": "Poziom",
+                            "value": "2",
+                            "normalizedValue": "floor_2",
+                        },
+                    ],
+                    "photos": [f"{self.base_url}/img/{ad_id};s={{width}}x{{height}}"],
+                    "location": {"cityName": "Kraków", "districtName": "Krowodrza"},
+                    "map": {"lat": 50.07, "lon": 19.91},
+                }
+            }
+        }
+        return web.Response(
+            text=(
+                "<html><head><script>window.__PRERENDERED_STATE__= "
+                f"{json.dumps(json.dumps(state))};</script></head><body></body></html>"
+            ),
+            content_type="text/html",
+        )
+
+    async def otodom_detail(self, request: web.Request) -> web.Response:
+        if (response := await self.respond("otodom_detail")) is not None:
+            return response
+
+        ad_id = int(request.match_info["slug"].rsplit("-ID", 1)[1])
+        price, area = self.ad_values(ad_id)
+        data = {
+            "props": {
+                "pageProps": {
+                    "ad": {
+                        "title": f"Mieszkanie {ad_id}",
+                        "createdAt": datetime.now(timezone.utc).isoformat(),
+                        "advertiserType": "private" if ad_id % 2 else "agency",
+                        "target": {"Price": price, "Area": str(area)},
+                        "characteristics": [
+                            {"key": "price", "label": "Cena", "localizedValue": f"{price} zł"},
+                            {"key": "m", "label": "Powierzchnia", "localizedValue": f"{area} m²"},
+                        ],
+                        "location": {
+                            "coordinates": {"latitude": 50.06, "longitude": 19.94},
+                            "address": {"city": {"name": "Kraków"}},
+                        },
+                        "images": [{"large": f"{self.base_url}/img/oto{ad_id}.jpg"}],
+                    }
+                }
+            }
+        }
+        return web.Response(
+            text=(
+                '<html><body><script id="__NEXT_DATA__" type="application/json">'
+                f"{json.dumps(data)}</script></body></html>"
+            ),
+            content_type="text/html",
+        )
+
+
+class TelegramStub(Stub):
+    """
+    Bot API stand-in for the methods the bot sends ads and broadcasts with.
+    Like Telegram it answers 429 over `global_rate` messages per second
+    or more than one message per second in a chat
+    """
+
+    def __init__(self, faults: Faults, global_rate: float = 30, seed: int = 0):
+        super().__init__(faults, seed)
+        self.global_rate = global_rate
+        self._sent_at: list[float] = []
+        self._chat_sent_at: dict[int, float] = {}
+        self._message_id = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.method)
+        return app
+
+    def error(self) -> web.Response:
+        return web.json_response(
+            {"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500
+        )
+
+    def throttle(self) -> web.Response:
+        return web.json_response(
+            {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            },
+            status=429,
+        )
+
+    def is_rate_limited(self, chat_id: int) -> bool:
+        now = time.monotonic()
+        self._sent_at = [sent_at for sent_at in self._sent_at if sent_at > now - 1]
+        if len(self._sent_at) >= self.global_rate or (
+            now - self._chat_sent_at.get(chat_id, -1) < 1
+        ):
+            return True
+
+        self._sent_at.append(now)
+        self._chat_sent_at[chat_id] = now
+        return False
+
+    async def method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if (response := await self.respond(method)) is not None:
+            return response
+
+        data = await request.post()
+        if method not in ("sendMessage", "sendPhoto", "sendMediaGroup"):
+            return web.json_response({"ok": True, "result": True})
+
+        chat_id = int(data["chat_id"])
+        if self.is_rate_limited(chat_id):
+            self.stats.throttled[method] += 1
+            return self.throttle()
+
+        if method == "sendMessage":
+            self.stats.messages_sent += 1
+            return web.json_response({"ok": True, "result": self.message(chat_id)})
+
+        media = json.loads(data["media"]) if method == "sendMediaGroup" else [data]
+        self.stats.messages_sent += len(media)
+        self.stats.photos_sent += len(media)
+        messages = [self.message(chat_id, photo=True) for _ in media]
+        return web.json_response(
+            {"ok": True, "result": messages if method == "sendMediaGroup" else messages[0]}
+        )
+
+    def message(self, chat_id: int, photo: bool = False) -> dict:
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        if photo:
+            message["photo"] = [
+                {
+                    "file_id": f"photo{self._message_id}",
+                    "file_unique_id": f"unique{self._message_id}",
+                    "width": 1000,
+                    "height": 750,
+                }
+            ]
+        return message
+
+
+async def start(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def bound_url(runner: web.AppRunner) -> str:
+    host, port = runner.addresses[0][:2]
+    return f"http://{host}:{port}"
@@ -1,11 +1,16 @@
 import asyncio
 import os
+import time
+from collections import deque
+from functools import partial
 
 from aiogram import Bot, Dispatcher, html
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart, Command
 from aiogram.types import (
@@ -20,23 +25,40 @@ from aiogram.types import (
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from dotenv import load_dotenv
 
-from db.user_handler import (
+from ad import Ad
+from ad_queue import AD_QUEUE_POLL_INTERVAL, create_ad_queue
+from db.async_user_handler import (
     activate_user,
     deactivate_user,
     delete_user,
-    get_all_users,
     get_all_active_users_with_city,
     get_user,
-    get_unique_cities,
-    get_unique_building_types,
     write_user,
     update_user_city,
     update_user_filter,
 )
-from db.sent_ads_handler import write_ad, filter_ads, delete_old_records
-from scraper import get_last_n_items, verify_city
+from db.async_broadcast_handler import create_broadcast, get_unfinished_broadcasts
+from db.async_sent_ads_handler import delete_old_records
+from db.config import async_engine
+from db.seen_ads import seen_ads
+from broadcast import run_broadcast
+from delivery import TELEGRAM_GLOBAL_RATE, Delivery, DeliveryQueue
+from freshness import freshness_stats
+from http_client import close_session
+from parsers import shutdown_pool
+from scheduler import FeedScheduler, feed_shard
+from scraper import stream_new_ads, verify_city
 from utils import are_cities_similar, remove_accents
 from logger import logger
+from matcher import AdMatcher
+from metrics import (
+    active_users,
+    ads_deduped,
+    delivery_queue_depth,
+    filter_seconds,
+    poll_cycle_seconds,
+    start_metrics_server,
+)
 
 
 load_dotenv()
@@ -51,8 +73,30 @@ else:
     raise ValueError(f"Unknown ENVIRONMENT: {ENVIRONMENT}")
 
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
+USERS_REFRESH_INTERVAL = float(os.getenv("USERS_REFRESH_INTERVAL", 60))
+# Custom Bot API server, e.g. a local one or a stand-in for load tests
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# "all" runs everything in one process. Otherwise scraper workers publish parsed ads
+# to the ad queue and sender workers deliver them, the first sender also handles updates
+ROLE = os.getenv("ROLE", "all").lower()
+if ROLE not in ("all", "scraper", "sender"):
+    raise ValueError(f"Unknown ROLE: {ROLE}")
+# Workers of a role are numbered from 0 to SHARD_COUNT - 1,
+# scrapers split feeds and senders split users between them
+SHARD = int(os.getenv("SHARD", 0))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 1))
+
 dp = Dispatcher()
-bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot = Bot(
+    token=TOKEN,
+    session=(
+        AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+        if TELEGRAM_API_URL
+        else None
+    ),
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+)
 
 
 class Form(StatesGroup):
@@ -62,136 +106,210 @@ class Form(StatesGroup):
 
 
 async def send_scheduled_message():
+    matcher = AdMatcher([])
+    users_refresh_at = 0
     while True:
-        logger.info(f"Deleting outdated saved ads")
-        delete_old_records()
-
-        try:
-            if ENVIRONMENT == "development":
-                users = [get_user(ADMIN_ID)]
-            else:
-                users = get_all_active_users_with_city()
-            unique_cities = get_unique_cities()
-            unique_building_types = get_unique_building_types()
-        except Exception as e:
-            logger.exception(f"Error during getting users from DB: {e}")
-            await asyncio.sleep(120)
-            continue
+        if time.monotonic() >= users_refresh_at:
+            logger.info(f"Deleting outdated saved ads")
+            await delete_old_records()
 
-        logger.info(
-            f"Getting ads for {len(unique_cities)} cities with "
-            f"{len(unique_building_types)} building types and "
-            f"sending to {len(users)} users"
-        )
-        items = {}
-        if unique_building_types:
-            tasks = [get_last_n_items(city, unique_building_types) for city in unique_cities]
-        else:
-            tasks = [get_last_n_items(city) for city in unique_cities]
-        for task in asyncio.as_completed(tasks):
             try:
-                city, results = await task
-                items[city] = results
+                users = await load_users()
             except Exception as e:
-                logger.exception(f"Error during requesting: {e}")
+                logger.exception(f"Error during getting users from DB: {e}")
+                await asyncio.sleep(120)
+                continue
 
-        tasks = [send_items(user, items) for user in users]
-        for task in asyncio.as_completed(tasks):
-            try:
-                await task
-            except Exception as e:
-                logger.warning(e, exc_info=True)
+            matcher = AdMatcher([user for user in users if user.city])
+            scheduler.sync(
+                feed for feed in matcher.feeds() if feed_shard(feed, SHARD_COUNT) == SHARD
+            )
+            active_users.set(len(users))
+            users_refresh_at = time.monotonic() + USERS_REFRESH_INTERVAL
+            logger.info(
+                f"Polling {len(scheduler)} feeds for {len(users)} users "
+                f"with {matcher.signatures_count} unique filter sets"
+            )
 
-        logger.info("All users were processed")
-        await asyncio.sleep(60)
+        # Feeds are polled in the background, so a slow one doesn't delay the others
+        feed_polled.clear()
+        for feed in scheduler.due():
+            task = asyncio.create_task(poll_feed(feed, matcher))
+            poll_tasks.add(task)
+            task.add_done_callback(poll_tasks.discard)
+            task.add_done_callback(lambda _: feed_polled.set())
 
+        # Polled feeds are rescheduled when their poll finishes, which may be sooner than
+        # the next poll that is due now
+        try:
+            await asyncio.wait_for(
+                feed_polled.wait(),
+                timeout=min(scheduler.seconds_until_next(), users_refresh_at - time.monotonic()),
+            )
+        except asyncio.TimeoutError:
+            pass
 
-async def send_items(user, items: dict[str, dict[str, list[dict]]]) -> None:
-    ads_count = 0
-    city = user.city
-    ad_type_filter = user.ad_type_filter
-    building_type_filter = user.building_type_filter
-    min_price_filter = user.min_price_filter
-    max_price_filter = user.max_price_filter
-    min_surface_area_filter = user.min_surface_area_filter
-    private_only_filter = user.private_only_filter
-
-    if ad_type_filter:
-        filtered_items_by_ad_type = items[city][ad_type_filter]
-    else:
-        filtered_items_by_ad_type = {}
-        for ad_type in items[city]:
-            filtered_items_by_ad_type[ad_type] = items[city][ad_type]
 
-    if building_type_filter:
-        filtered_items = filtered_items_by_ad_type[building_type_filter]
+async def load_users() -> list:
+    if ENVIRONMENT == "development":
+        users = [await get_user(ADMIN_ID)]
     else:
-        filtered_items = []
-        for building_type in filtered_items_by_ad_type:
-            filtered_items.extend(filtered_items_by_ad_type[building_type])
+        users = await get_all_active_users_with_city()
+    if ROLE == "sender":
+        # Telegram ids are spread evenly enough for the modulo to be the hash
+        users = [user for user in users if user.user_id % SHARD_COUNT == SHARD]
+    if ROLE != "scraper":
+        await seen_ads.load(user.user_id for user in users)
+    return users
 
-    del items
-    del filtered_items_by_ad_type
 
-    for item in filtered_items:
-        title = item["title"]
-        price = item["price"]
-        price_int = int("".join(char for char in price if char.isdigit()))
+async def poll_feed(feed: tuple[str, str, str], matcher: AdMatcher) -> None:
+    """
+    Queues every new ad of the feed for its users as soon as the ad is parsed
+    """
+    city, ad_type, building_type = feed
+    started_at = time.perf_counter()
+    ads_count = 0
+    queued_count = 0
+    new_cards = {}
+    try:
+        async for _, _, ad in stream_new_ads(
+            city,
+            [building_type],
+            [ad_type],
+            card_filter=partial(matcher.accepts_card, city),
+            new_cards=new_cards,
+        ):
+            ads_count += 1
+            if ROLE == "scraper":
+                await ad_queue.publish(feed, ad)
+            else:
+                queued_count += len(await dispatch_ad(feed, ad, matcher))
+    except Exception as e:
+        logger.exception(f"Error during requesting {ad_type}/{building_type} for {city}: {e}")
+        scheduler.record(feed, None)
+        return
+
+    poll_duration = time.perf_counter() - started_at
+    poll_cycle_seconds.set(poll_duration)
+    freshness_stats.record_poll(poll_duration)
+    # Cards nobody's filters accept still count, so a busy feed isn't mistaken for a quiet one
+    interval = scheduler.record(feed, new_cards.get((ad_type, building_type), 0))
+    if ROLE == "scraper":
+        handed_over = "published them to the ad queue"
+    else:
+        handed_over = (
+            f"queued {queued_count} messages, {len(delivery_queue)} are waiting for delivery"
+        )
+    logger.info(
+        f"Got {ads_count} new ads of {ad_type}/{building_type} for {city}, {handed_over}, "
+        f"next poll in ~{interval:.0f} seconds"
+    )
 
-        if min_price_filter and price_int < min_price_filter:
-            logger.info(
-                f"Skipping ad {title} due to min price filter ({min_price_filter}) > {price_int})"
-            )
+
+async def consume_ads() -> None:
+    """
+    Queues ads published by the scraper workers for the users of this sender's shard.
+    An ad's offset is committed once its deliveries and those of the ads before it
+    are finished, so ads still waiting for delivery are read again after a crash
+    """
+    consumer = f"sender-{SHARD}-of-{SHARD_COUNT}"
+    matcher = AdMatcher([])
+    users_refresh_at = 0
+    position = None
+    is_positioned = False
+    unfinished: deque[tuple[str, list[Delivery]]] = deque()
+    while True:
+        if time.monotonic() >= users_refresh_at:
+            try:
+                users = await load_users()
+            except Exception as e:
+                logger.exception(f"Error during getting users from DB: {e}")
+                await asyncio.sleep(120)
+                continue
+
+            matcher = AdMatcher([user for user in users if user.city])
+            active_users.set(len(users))
+            users_refresh_at = time.monotonic() + USERS_REFRESH_INTERVAL
+            logger.info(f"Sending ads to {len(users)} users of shard {SHARD}/{SHARD_COUNT}")
+
+        timeout = max(users_refresh_at - time.monotonic(), 0)
+        if unfinished:
+            timeout = min(timeout, AD_QUEUE_POLL_INTERVAL)
+        try:
+            if not is_positioned:
+                position = await ad_queue.committed(consumer)
+                is_positioned = True
+            entries = await ad_queue.read(position, timeout=timeout)
+            queued_count = 0
+            for entry in entries:
+                deliveries = await dispatch_ad(entry.feed, entry.ad, matcher)
+                unfinished.append((entry.offset, deliveries))
+                queued_count += len(deliveries)
+                position = entry.offset
+
+            offset = None
+            while unfinished and not any(map(delivery_queue.is_pending, unfinished[0][1])):
+                offset, _ = unfinished.popleft()
+            if offset is not None:
+                await ad_queue.commit(consumer, offset)
+        except Exception as e:
+            logger.exception(f"Error during reading the ad queue: {e}")
+            await asyncio.sleep(5)
             continue
-        if max_price_filter and price_int > max_price_filter:
+
+        if entries:
             logger.info(
-                f"Skipping ad {title} due to max price filter ({max_price_filter}) < {price_int})"
+                f"Got {len(entries)} ads from the queue, queued {queued_count} messages, "
+                f"{len(delivery_queue)} are waiting for delivery"
             )
-            continue
 
-        joined_features = " ".join(item["features"]).lower()
-        if min_surface_area_filter and "powierzchnia" in joined_features:
-            surface_area_str = next(
-                (feature for feature in item["features"] if "Powierzchnia" in feature),
-                None,
-            )
-            if surface_area_str:
-                try:
-                    surface_area = int("".join(filter(str.isdigit, surface_area_str)))
-                    if surface_area < min_surface_area_filter:
-                        logger.info(
-                            f"Skipping ad {title} due to min surface area filter ({min_surface_area_filter}) > {surface_area})"
-                        )
-                        continue
-                except ValueError:
-                    logger.warning(f"Could not parse surface area from string: {surface_area_str}")
-                    continue
-
-        if private_only_filter and (
-            "prywatn" not in joined_features or "deweloper" not in joined_features
-        ):
-            logger.info(f"Skipping ad {title} due to private only filter")
-            continue
 
-        location = item["location"][:40] + "..." if len(item["location"]) > 40 else item["location"]
-        publication_time = item["publication_time"]
-        features = "".join(f"▫️ {feature}\n" for feature in item["features"])
-        item_link = item["item_link"]
-        item_img = item["item_img"]
+async def dispatch_ad(
+    feed: tuple[str, str, str], ad: Ad, matcher: AdMatcher
+) -> list[Delivery]:
+    city, ad_type, building_type = feed
+    deliveries = []
+    for user in matcher.match(city, ad_type, building_type, ad):
+        try:
+            deliveries += await send_items(user, [ad])
+        except Exception as e:
+            logger.warning(e, exc_info=True)
+    return deliveries
 
-        ads_seen_by_user = filter_ads(user.user_id)
 
-        if item_link in ads_seen_by_user:
-            continue
-        else:
-            text = f"<strong><a href='{item_link}'>{title}</a></strong>\n \
-            \n{price} | {location}\nPublished: {publication_time}\n \
-            \nFeatures: \n{features}"
+async def send_items(user, ads: list[Ad]) -> list[Delivery]:
+    deliveries = []
+    with filter_seconds.time():
+        for ad in ads:
+            # Links used to be stored as they came from the site, so both forms are checked
+            if await seen_ads.is_seen(user.user_id, ad.canonical_url, ad.url):
+                ads_deduped.inc()
+                continue
 
-            await bot.send_photo(chat_id=user.chat_id, photo=item_img, caption=text)
-            write_ad(user.user_id, item_link)
-            ads_count += 1
-    logger.info(f"Sent {ads_count} items for user {user.user_id}")
+            delivery = Delivery(user.user_id, user.chat_id, ad, city=user.city)
+            if delivery_queue.put(delivery):
+                deliveries.append(delivery)
+    return deliveries
+
+
+async def mark_delivered(delivery: Delivery) -> None:
+    freshness_stats.record_delivery(delivery.city, delivery.ad)
+    await seen_ads.mark(delivery.user_id, delivery.ad.canonical_url)
+
+
+# Telegram's global limit is per bot token, so sender workers share it
+delivery_queue = DeliveryQueue(
+    bot,
+    on_sent=mark_delivered,
+    global_rate=TELEGRAM_GLOBAL_RATE / SHARD_COUNT if ROLE == "sender" else TELEGRAM_GLOBAL_RATE,
+)
+delivery_queue_depth.function = lambda: len(delivery_queue)
+scheduler = FeedScheduler()
+poll_tasks: set[asyncio.Task] = set()
+feed_polled = asyncio.Event()
+ad_queue = create_ad_queue() if ROLE != "all" else None
+broadcast_tasks: set[asyncio.Task] = set()
 
 
 @dp.message(CommandStart())
@@ -214,9 +332,9 @@ async def command_start_handler(message: Message, state: FSMContext, user_id: in
         user_id = message.from_user.id
     logger.info(f"Received /start from user {user_id}")
 
-    user = get_user(user_id)
+    user = await get_user(user_id)
     if not user:
-        write_user(
+        await write_user(
             user_id,
             message.chat.id,
             message.from_user.full_name,
@@ -232,7 +350,7 @@ async def command_start_handler(message: Message, state: FSMContext, user_id: in
         await state.set_state(Form.waiting_for_city)
 
     else:
-        activate_user(user_id)
+        await activate_user(user_id)
         city = user.city if user.city else "None"
         await message.answer(
             f"Hi again, {html.bold(user.full_name)}!\
@@ -240,7 +358,7 @@ async def command_start_handler(message: Message, state: FSMContext, user_id: in
             reply_markup=inline_kb.as_markup(),
         )
 
-    if not hasattr(dp, "scheduled_task"):
+    if ROLE == "all" and not hasattr(dp, "scheduled_task"):
         logger.info("Setting scheduled task")
         dp.scheduled_task = asyncio.create_task(send_scheduled_message())
 
@@ -274,7 +392,7 @@ async def command_pause_handler(message: Message) -> None:
     inline_kb.button(text="Start to resume", callback_data="start")
 
     user_id = message.from_user.id
-    deactivate_user(user_id)
+    await deactivate_user(user_id)
     logger.info(f"Received /pause from user {user_id}")
     await message.answer("Bot is paused", reply_markup=inline_kb.as_markup())
 
@@ -287,15 +405,27 @@ async def send_message_by_admin(message: Message, state: FSMContext) -> None:
         await state.set_state(Form.waiting_for_admin_message)
 
 
+@dp.message(Command("stats"))
+async def command_stats_handler(message: Message) -> None:
+    user_id = message.from_user.id
+    if user_id == ADMIN_ID:
+        await message.answer(freshness_stats.report())
+
+
 @dp.message(Form.waiting_for_admin_message)
 async def send_message_to_users(message: Message, state: FSMContext):
-    users = get_all_users()
-    tasks = [bot.send_message(user.chat_id, message.text) for user in users]
-    await asyncio.gather(*tasks)
-    await message.answer("Message sent successfully")
+    broadcast = await create_broadcast(message.chat.id, message.text)
+    start_broadcast(broadcast)
+    await message.answer("Broadcast started, you'll get a report when it's finished")
     await state.clear()
 
 
+def start_broadcast(broadcast) -> None:
+    task = asyncio.create_task(run_broadcast(bot, broadcast, delivery_queue.bucket))
+    broadcast_tasks.add(task)
+    task.add_done_callback(broadcast_tasks.discard)
+
+
 @dp.message(Form.waiting_for_city)
 async def set_city(message: Message, state: FSMContext) -> None:
     inline_kb = InlineKeyboardBuilder()
@@ -311,7 +441,7 @@ async def set_city(message: Message, state: FSMContext) -> None:
             reply_markup=inline_kb.as_markup(),
         )
     else:
-        update_user_city(message.from_user.id, city_normalized)
+        await update_user_city(message.from_user.id, city_normalized)
         await message.answer(
             f"Thank you! Your city was set to {html.bold(city)}, now sit back and wait for new links ;)"
         )
@@ -333,7 +463,7 @@ async def set_filter_value(message: Message, state: FSMContext):
             await message.answer("Please provide a valid number")
             return
         value = int(message.text)
-        update_user_filter(user_id, filter_type, value)
+        await update_user_filter(user_id, filter_type, value)
         await message.answer(f"Your <em>{filter_type.replace("_", " ")}</em> is set to {value}")
     else:
         await message.answer("Unknown filter type, please try again")
@@ -433,7 +563,7 @@ async def handle_callback_query(callback: CallbackQuery, state: FSMContext):
             value = None
         if value in ("True", "False"):
             value = value == "True"
-        update_user_filter(user_id, filter_type, value)
+        await update_user_filter(user_id, filter_type, value)
         await callback.message.delete()
         await callback.message.answer(
             f"Your <em>{filter_type.replace("_", " ")}</em> is set to {value}"
@@ -447,7 +577,7 @@ async def handle_reply(message: Message, state: FSMContext):
     elif message.text == "Pause":
         await command_pause_handler(message)
     elif message.text == "Filters":
-        user = get_user(message.from_user.id)
+        user = await get_user(message.from_user.id)
         keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
                 [
@@ -488,7 +618,36 @@ async def handle_reply(message: Message, state: FSMContext):
 
 @dp.message()
 async def main() -> None:
-    await dp.start_polling(bot)
+    metrics_server = await start_metrics_server()
+    workers = []
+    if ROLE == "scraper":
+        workers.append(asyncio.create_task(send_scheduled_message()))
+    else:
+        workers.append(asyncio.create_task(seen_ads.run_flusher()))
+        delivery_queue.start()
+    if ROLE == "sender":
+        workers.append(asyncio.create_task(consume_ads()))
+    try:
+        # Telegram gives updates to a single poller, so only one worker handles them
+        if ROLE == "scraper" or SHARD:
+            await asyncio.gather(*workers)
+        else:
+            for broadcast in await get_unfinished_broadcasts():
+                start_broadcast(broadcast)
+            await dp.start_polling(bot)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        if ROLE != "scraper":
+            await delivery_queue.stop()
+            await seen_ads.drain()
+        if ad_queue is not None:
+            await ad_queue.close()
+        await close_session()
+        await async_engine.dispose()
+        shutdown_pool()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
 
 
 if __name__ == "__main__":
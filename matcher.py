@@ -0,0 +1,136 @@
+import bisect
+from dataclasses import dataclass, field
+from math import inf
+
+from ad import Ad, Card, OwnerType
+from scraper import AD_TYPES, BUILDING_TYPES
+
+
+@dataclass
+class FilterGroup:
+    """
+    Users with identical filters, so the ad is evaluated once for all of them
+    """
+
+    min_price: int
+    max_price: float
+    min_surface_area: int
+    private_only: bool
+    users: list = field(default_factory=list)
+
+
+class AdMatcher:
+    """
+    Index of users' filters built once per cycle: every (city, ad_type, building_type) bucket
+    holds filter groups sorted by min price. None ad/building type means "any"
+    """
+
+    def __init__(self, users: list):
+        groups: dict[tuple, FilterGroup] = {}
+        for user in users:
+            signature = (
+                user.city,
+                user.ad_type_filter or None,
+                user.building_type_filter or None,
+                user.min_price_filter or 0,
+                user.max_price_filter or inf,
+                user.min_surface_area_filter or 0,
+                bool(user.private_only_filter),
+            )
+            if signature not in groups:
+                groups[signature] = FilterGroup(*signature[3:])
+            groups[signature].users.append(user)
+
+        buckets: dict[tuple[str, str | None, str | None], list[FilterGroup]] = {}
+        for (city, ad_type, building_type, *_), group in groups.items():
+            buckets.setdefault((city, ad_type, building_type), []).append(group)
+
+        self._buckets: dict[tuple, tuple[list[int], list[FilterGroup]]] = {}
+        for key, bucket_groups in buckets.items():
+            bucket_groups.sort(key=lambda group: group.min_price)
+            self._buckets[key] = ([group.min_price for group in bucket_groups], bucket_groups)
+
+        self.signatures_count = len(groups)
+
+    def feeds(self) -> set[tuple[str, str, str]]:
+        """
+        Returns the (city, ad_type, building_type) feeds somebody is interested in
+        """
+        feeds = set()
+        for city, ad_type, building_type in self._buckets:
+            for feed_ad_type in [ad_type] if ad_type else AD_TYPES:
+                for feed_building_type in [building_type] if building_type else BUILDING_TYPES:
+                    feeds.add((city, feed_ad_type, feed_building_type))
+        return feeds
+
+    def accepts_card(self, city: str, ad_type: str, building_type: str, card: Card) -> bool:
+        """
+        Checks whether anybody could receive the ad judging by its listing card.
+        Unknown card fields and the owner type don't exclude anybody, the ad is matched
+        again after its detail page is parsed
+        """
+        for key in (
+            (city, ad_type, building_type),
+            (city, ad_type, None),
+            (city, None, building_type),
+            (city, None, None),
+        ):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+
+            min_prices, groups = bucket
+            if card.price_value is not None:
+                groups = groups[: bisect.bisect_right(min_prices, card.price_value)]
+
+            for group in groups:
+                if card.price_value is not None and card.price_value > group.max_price:
+                    continue
+                if (
+                    group.min_surface_area
+                    and card.area is not None
+                    and card.area < group.min_surface_area
+                ):
+                    continue
+                return True
+
+        return False
+
+    def match(self, city: str, ad_type: str, building_type: str, ad: Ad) -> list:
+        price = ad.price_value
+        surface_area = ad.area
+        private = ad.owner_type is OwnerType.PRIVATE
+
+        users = []
+        for key in (
+            (city, ad_type, building_type),
+            (city, ad_type, None),
+            (city, None, building_type),
+            (city, None, None),
+        ):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+
+            min_prices, groups = bucket
+            if price is None:
+                candidates = [
+                    group for group in groups if not group.min_price and group.max_price == inf
+                ]
+            else:
+                candidates = groups[: bisect.bisect_right(min_prices, price)]
+
+            for group in candidates:
+                if price is not None and price > group.max_price:
+                    continue
+                if (
+                    group.min_surface_area
+                    and surface_area is not None
+                    and surface_area < group.min_surface_area
+                ):
+                    continue
+                if group.private_only and not private:
+                    continue
+                users.extend(group.users)
+
+        return users
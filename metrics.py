@@ -0,0 +1,177 @@
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from logger import logger
+
+
+load_dotenv()
+
+# Metrics are served in the Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics,
+# 0 port disables the endpoint
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        registry.append(self)
+
+    @abstractmethod
+    def samples(self) -> Iterator[tuple[str, Labels, float]]: ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(
+            f"{name}{_format_labels(labels)} {_format_value(value)}"
+            for name, labels, value in self.samples()
+        )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        for labels, value in self._values.items():
+            yield self.name, labels, value
+
+
+class Gauge(Metric):
+    """
+    Gauge that is either set explicitly or read from `function` on every scrape
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float] | None = None):
+        super().__init__(name, documentation)
+        self.function = function
+        self._values: dict[Labels, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        self._values[_labels(labels)] = value
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        if self.function is not None:
+            yield self.name, (), self.function()
+        for labels, value in self._values.items():
+            yield self.name, labels, value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = (*sorted(buckets), math.inf)
+        self._counts: dict[Labels, list[int]] = {}
+        self._sums: dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels(labels)
+        counts = self._counts.setdefault(key, [0] * len(self.buckets))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self._sums[key] = self._sums.get(key, 0) + value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        for labels, counts in self._counts.items():
+            for bound, count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", (*labels, ("le", _format_value(bound))), count
+            yield f"{self.name}_count", labels, counts[-1]
+            yield f"{self.name}_sum", labels, self._sums[labels]
+
+
+registry: list[Metric] = []
+
+listing_fetch_seconds = Histogram(
+    "rent_finder_listing_fetch_seconds", "Time to download a listing page"
+)
+detail_fetch_seconds = Histogram("rent_finder_detail_fetch_seconds", "Time to download an ad page")
+parse_seconds = Histogram("rent_finder_parse_seconds", "Time to parse an ad page")
+filter_seconds = Histogram(
+    "rent_finder_filter_seconds", "Time to filter out already sent ads for a user"
+)
+send_seconds = Histogram("rent_finder_send_seconds", "Time of a Bot API call sending ads")
+http_responses = Counter("rent_finder_http_responses_total", "Scraper HTTP responses by status")
+parse_failures = Counter("rent_finder_parse_failures_total", "Ad pages that couldn't be parsed")
+ads_sent = Counter("rent_finder_ads_sent_total", "Ads delivered to users")
+ads_deduped = Counter("rent_finder_ads_deduped_total", "Matched ads skipped as already sent")
+poll_cycle_seconds = Gauge("rent_finder_poll_cycle_seconds", "Duration of the last feed poll")
+active_users = Gauge("rent_finder_active_users", "Users ads are matched for")
+delivery_queue_depth = Gauge("rent_finder_delivery_queue_depth", "Ads waiting for delivery")
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(
+    host: str = METRICS_HOST, port: int = METRICS_PORT
+) -> web.AppRunner | None:
+    if not port:
+        return None
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
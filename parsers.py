@@ -0,0 +1,528 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, time as dt_time
+from typing import Any, Callable
+from urllib.parse import urlsplit
+
+from bs4 import BeautifulSoup, SoupStrainer
+from dotenv import load_dotenv
+
+from ad import Ad, Card, parse_card_area, parse_price
+from http_client import Response
+from logger import logger
+from utils import convert_utc_to_local, local_today, to_local_datetime
+
+
+load_dotenv()
+image_placeholder = "https://archive.org/download/placeholder-image/placeholder-image.jpg"
+
+# Origins that ad links are built from and recognized by, taken from OLX_URL
+# so that the scraper can be pointed at local stand-ins
+olx_url = urlsplit(os.getenv("OLX_URL") or "https://www.olx.pl/")
+olx_base_url = f"{olx_url.scheme}://{olx_url.netloc}"
+otodom_base_url = os.getenv("OTODOM_URL", "https://www.otodom.pl").rstrip("/")
+
+# Parsing is CPU-bound, so it runs in worker processes to keep the event loop free,
+# 0 workers parses inline
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", os.cpu_count() or 1))
+
+# "html.parser", "lxml" or "selectolax", the BeautifulSoup backends only build
+# the subtrees the parsers actually read
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "html.parser")
+
+if PARSER_BACKEND == "selectolax":
+    from selectolax.lexbor import LexborHTMLParser
+elif PARSER_BACKEND not in ("html.parser", "lxml"):
+    raise ValueError(f"Unknown PARSER_BACKEND: {PARSER_BACKEND}")
+
+_pool: ProcessPoolExecutor | None = None
+
+# Both sites embed the whole ad as JSON, which is faster to read and changes less often
+# than the markup, the DOM selectors below are only a fallback
+# The state is a JSON string of hundreds of KB, runs of plain characters are matched at once
+# instead of one alternation per character
+olx_state_pattern = re.compile(r'window\.__PRERENDERED_STATE__\s*=\s*("[^"\\]*(?:\\.[^"\\]*)*")')
+otodom_state_pattern = re.compile(
+    r'<script id="__NEXT_DATA__" type="application/json"[^>]*>(.*?)</script>', re.DOTALL
+)
+otodom_owner_types = {
+    "private": "prywatny",
+    "business": "biuro nieruchomości",
+    "developer": "deweloper",
+}
+OLX_IMAGE_WIDTH = 1000
+OLX_IMAGE_HEIGHT = 750
+
+
+def _has_attr(attrs: dict, name: str, value: str) -> bool:
+    attr = attrs.get(name) or ""
+    return value in (attr if isinstance(attr, list) else attr.split())
+
+
+card_strainer = SoupStrainer(
+    lambda name, attrs: name == "div" and _has_attr(attrs, "data-testid", "l-card")
+)
+olx_strainer = SoupStrainer(
+    lambda name, attrs: (name == "div" and _has_attr(attrs, "data-cy", "offer_title"))
+    or (name == "div" and _has_attr(attrs, "data-testid", "ad-price-container"))
+    or (name == "div" and _has_attr(attrs, "data-testid", "ad-parameters-container"))
+    or (name == "span" and _has_attr(attrs, "data-cy", "ad-posted-at"))
+    or (name == "li" and _has_attr(attrs, "data-testid", "breadcrumb-item"))
+    or (name == "img" and _has_attr(attrs, "class", "css-1bmvjcs"))
+)
+otodom_strainer = SoupStrainer(
+    lambda name, attrs: (name == "h1" and _has_attr(attrs, "data-cy", "adPageAdTitle"))
+    or (name == "strong" and _has_attr(attrs, "data-cy", "adPageHeaderPrice"))
+    or (
+        name == "div"
+        and attrs.get("data-sentry-component") in ("MapLink", "AdHistoryBase", "AdDetailsBase")
+    )
+    or name in ("picture", "img")
+)
+
+
+def get_pool() -> ProcessPoolExecutor | None:
+    global _pool
+    if _pool is None and PARSER_WORKERS > 0:
+        _pool = ProcessPoolExecutor(
+            max_workers=PARSER_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+async def run_parser(func: Callable[..., Any], *args: Any) -> Any:
+    pool = get_pool()
+    if pool is None:
+        return func(*args)
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # A worker that died, e.g. killed for memory on a huge page, breaks the whole pool
+        logger.warning("Parser worker process died, restarting the pool")
+        discard_pool(pool)
+        return await loop.run_in_executor(get_pool(), func, *args)
+
+
+def discard_pool(pool: ProcessPoolExecutor) -> None:
+    """
+    Drops the pool unless a concurrent call has already replaced it
+    """
+    global _pool
+    if _pool is pool:
+        pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+
+def extract_cards(content: bytes) -> list[Card]:
+    cards = []
+    if PARSER_BACKEND == "selectolax":
+        card_nodes = LexborHTMLParser(content).css(
+            "div[data-testid='l-card']:not([style*='display: none !important'])"
+        )
+    else:
+        card_nodes = BeautifulSoup(content, PARSER_BACKEND, parse_only=card_strainer).select(
+            "div[data-testid='l-card']:not([style*='display: none !important'])"
+        )
+    for card in card_nodes:
+        try:
+            if PARSER_BACKEND == "selectolax":
+                is_promoted = card.css_first("[class=css-1dyfc0k]") is not None
+                item_url = card.css_first("a").attributes.get("href")
+                price_node = card.css_first("[data-testid=ad-price]")
+                price = price_node.text() if price_node else ""
+                text = card.text(separator=" ")
+            else:
+                is_promoted = card.select_one("[class=css-1dyfc0k]") is not None
+                item_url = card.find("a").get("href")
+                price_node = card.select_one("[data-testid=ad-price]")
+                price = price_node.get_text() if price_node else ""
+                text = card.get_text(" ")
+            if is_promoted:
+                continue
+
+            link = (
+                f"{olx_base_url}/{item_url.lstrip('/')}"
+                if not item_url.startswith(otodom_base_url)
+                else item_url
+            )
+            cards.append(Card(link, parse_price(price), parse_card_area(text)))
+
+        except Exception as e:
+            logger.exception(f"Error during scraping links: {e}")
+
+    return cards
+
+
+def parse_item(response: Response) -> Ad | None:
+    if response.url.startswith(otodom_base_url):
+        item = parse_otodom(response)
+    elif response.url.startswith(olx_base_url):
+        item = parse_olx(response)
+    else:
+        logger.error(f"Couldn't parse {response.url}")
+        return None
+
+    return Ad.from_parsed(item) if item else None
+
+
+def parse_olx(response: Response) -> dict | None:
+    try:
+        return parse_olx_state(response)
+    except Exception as e:
+        logger.warning(f"Couldn't use embedded OLX state of {response.url}, parsing markup: {e!r}")
+
+    if PARSER_BACKEND == "selectolax":
+        return _parse_olx_selectolax(response)
+    return _parse_olx_soup(response)
+
+
+def parse_olx_state(response: Response) -> dict | None:
+    """
+    Reads the ad from the `window.__PRERENDERED_STATE__` blob, raises if it's missing
+    or doesn't have the expected shape
+    """
+    match = olx_state_pattern.search(response.content.decode("utf-8", errors="replace"))
+    if match is None:
+        raise LookupError("No __PRERENDERED_STATE__ on the page")
+    ad = json.loads(json.loads(match.group(1)))["ad"]["ad"]
+
+    published_at = to_local_datetime(ad["createdTime"])
+    if published_at.date() != local_today():
+        logger.warning(f"Publication date {published_at.date()} is not today, skipping")
+        return None
+
+    params = ad.get("params") or []
+    area = next((param["normalizedValue"] for param in params if param["key"] == "m"), None)
+    features = ["Firmowe" if ad["isBusiness"] else "Prywatne"]
+    features.extend(f"{param['name']}: {param['value']}" for param in params)
+
+    images = [
+        photo.format(width=OLX_IMAGE_WIDTH, height=OLX_IMAGE_HEIGHT)
+        for photo in ad.get("photos") or []
+    ]
+    location = ad.get("location") or {}
+    coordinates = ad.get("map") or {}
+
+    return {
+        "title": ad["title"],
+        "price": ad["price"]["displayValue"].lower(),
+        "location": ", ".join(
+            name for name in (location.get("cityName"), location.get("districtName")) if name
+        ),
+        "publication_time": published_at.strftime("%H:%M"),
+        "features": list(reversed(features)),
+        "item_link": response.url,
+        "item_img": images[0] if images else image_placeholder,
+        "area": float(area) if area else None,
+        "coordinates": ((coordinates["lat"], coordinates["lon"]) if "lat" in coordinates else None),
+        "owner_type": "business" if ad["isBusiness"] else "private",
+        "published_at": published_at.isoformat(),
+        "images": images,
+    }
+
+
+def _parse_olx_soup(response: Response) -> dict | None:
+    item = BeautifulSoup(response.content, PARSER_BACKEND, parse_only=olx_strainer)
+    try:
+        item_link = response.url
+        title = item.find("div", {"data-cy": "offer_title"}).text
+        price = (
+            item.find("div", {"data-testid": "ad-price-container"})
+            .text.lower()
+            .split(" do negocjacji")[0]
+        )
+
+        try:
+            posted_at = item.find("span", {"data-cy": "ad-posted-at"}).text
+        except AttributeError:
+            posted_at = None
+        publication_time = format_olx_publication_time(posted_at, item_link)
+        if publication_time is None:
+            return None
+
+        location = ", ".join(
+            "".join(i.a.text.split(" - ")[-1])
+            for i in item.find_all("li", {"data-testid": "breadcrumb-item"})[-2:]
+        )
+
+        features = list(
+            reversed(
+                [
+                    item.text
+                    for item in (
+                        item.find("div", {"data-testid": "ad-parameters-container"}).find_all("p")
+                    )
+                ]
+            )
+        )
+
+        try:
+            item_img = item.find("img", {"class": "css-1bmvjcs"})["srcset"].split(" ")[-2]
+        except (KeyError, TypeError):
+            logger.warning(f"Couldn't get image for {item_link}")
+            item_img = image_placeholder
+
+        return {
+            "title": title,
+            "price": price,
+            "location": location,
+            "publication_time": publication_time,
+            "features": features,
+            "item_link": item_link,
+            "item_img": item_img,
+        }
+
+    except Exception as e:
+        logger.exception(f"Error during detailed OLX parsing: {e}, item URL: {response.url}")
+
+
+def _parse_olx_selectolax(response: Response) -> dict | None:
+    item = LexborHTMLParser(response.content)
+    try:
+        item_link = response.url
+        title = item.css_first("div[data-cy='offer_title']").text()
+        price = (
+            item.css_first("div[data-testid='ad-price-container']")
+            .text()
+            .lower()
+            .split(" do negocjacji")[0]
+        )
+
+        posted_at = item.css_first("span[data-cy='ad-posted-at']")
+        publication_time = format_olx_publication_time(
+            posted_at.text() if posted_at else None, item_link
+        )
+        if publication_time is None:
+            return None
+
+        location = ", ".join(
+            "".join(i.css_first("a").text().split(" - ")[-1])
+            for i in item.css("li[data-testid='breadcrumb-item']")[-2:]
+        )
+
+        features = list(
+            reversed(
+                [
+                    p.text()
+                    for p in item.css_first("div[data-testid='ad-parameters-container']").css("p")
+                ]
+            )
+        )
+
+        img = item.css_first("img.css-1bmvjcs")
+        if img is not None and img.attributes.get("srcset") is not None:
+            item_img = img.attributes["srcset"].split(" ")[-2]
+        else:
+            logger.warning(f"Couldn't get image for {item_link}")
+            item_img = image_placeholder
+
+        return {
+            "title": title,
+            "price": price,
+            "location": location,
+            "publication_time": publication_time,
+            "features": features,
+            "item_link": item_link,
+            "item_img": item_img,
+        }
+
+    except Exception as e:
+        logger.exception(f"Error during detailed OLX parsing: {e}, item URL: {response.url}")
+
+
+def format_olx_publication_time(posted_at: str | None, item_link: str) -> str | None:
+    """
+    Returns None for ads that weren't published today
+    """
+    if posted_at is None:
+        logger.warning(f"Couldn't get publication_time for {item_link}")
+        return "N/A"
+
+    publication_time = convert_utc_to_local(posted_at.split(" o ")[-1])
+    if isinstance(publication_time, dt_time):
+        publication_time = publication_time.strftime("%H:%M")
+    elif isinstance(publication_time, date):
+        if publication_time != local_today():
+            logger.warning(f"Publication date {publication_time} is not today, skipping")
+            return None
+        publication_time = publication_time.strftime("%B %d, %Y")
+
+    return publication_time
+
+
+def parse_otodom(response: Response) -> dict:
+    try:
+        return parse_otodom_state(response)
+    except Exception as e:
+        logger.warning(
+            f"Couldn't use embedded Otodom state of {response.url}, parsing markup: {e!r}"
+        )
+
+    if PARSER_BACKEND == "selectolax":
+        return _parse_otodom_selectolax(response)
+    return _parse_otodom_soup(response)
+
+
+def parse_otodom_state(response: Response) -> dict:
+    """
+    Reads the ad from the `__NEXT_DATA__` JSON, raises if it's missing
+    or doesn't have the expected shape
+    """
+    match = otodom_state_pattern.search(response.content.decode("utf-8", errors="replace"))
+    if match is None:
+        raise LookupError("No __NEXT_DATA__ on the page")
+    ad = json.loads(match.group(1))["props"]["pageProps"]["ad"]
+
+    characteristics = {
+        characteristic["key"]: characteristic for characteristic in ad.get("characteristics") or []
+    }
+    features = [
+        f"{characteristic['label']}: {characteristic['localizedValue']}"
+        for key, characteristic in characteristics.items()
+        if key != "price"
+    ]
+    owner_type = ad.get("advertiserType")
+    if owner_type in otodom_owner_types:
+        features.append(f"Typ ogłoszeniodawcy: {otodom_owner_types[owner_type]}")
+
+    published_at = to_local_datetime(ad["createdAt"])
+    if published_at.date() == local_today():
+        publication_time = published_at.strftime("%H:%M")
+    else:
+        publication_time = published_at.strftime("%B %d, %Y")
+
+    address = (ad.get("location") or {}).get("address") or {}
+    coordinates = (ad.get("location") or {}).get("coordinates") or {}
+    area = ad.get("target", {}).get("Area")
+    images = [image["large"] for image in ad.get("images") or [] if image.get("large")]
+
+    return {
+        "title": ad["title"],
+        "price": (
+            characteristics["price"]["localizedValue"]
+            if "price" in characteristics
+            else f"{ad['target']['Price']} zł"
+        ),
+        "location": ", ".join(
+            (address.get(part) or {}).get("name")
+            for part in ("street", "district", "city", "province")
+            if (address.get(part) or {}).get("name")
+        ),
+        "publication_time": publication_time,
+        "features": features,
+        "item_link": response.url,
+        "item_img": images[0] if images else image_placeholder,
+        "area": float(area) if area else None,
+        "coordinates": (
+            (coordinates["latitude"], coordinates["longitude"])
+            if "latitude" in coordinates
+            else None
+        ),
+        "owner_type": owner_type,
+        "published_at": published_at.isoformat(),
+        "images": images,
+    }
+
+
+def _parse_otodom_soup(response: Response) -> dict:
+    item = BeautifulSoup(response.content, PARSER_BACKEND, parse_only=otodom_strainer)
+    try:
+        item_link = response.url
+        title = item.find("h1", {"data-cy": "adPageAdTitle"}).text
+        price = item.find("strong", {"data-cy": "adPageHeaderPrice"}).text
+        location = item.find("div", {"data-sentry-component": "MapLink"}).find("a").text
+        publication_time = (
+            item.find("div", {"data-sentry-component": "AdHistoryBase"})
+            .find("p")
+            .text.split(" ")[-1]
+        )
+        features = [
+            " ".join(sub.text for sub in feature.find_all("div"))
+            for feature in (
+                item.find("div", {"data-sentry-component": "AdDetailsBase"})
+                .find("div")
+                .find_all("div", {"data-sentry-element": "ItemGridContainer"})
+            )
+        ]
+
+        try:
+            item_img = item.find("picture").find_next("img")["src"]
+        except Exception as e:
+            logger.warning(f"Couldn't get image for {item_link}: {e}")
+            item_img = image_placeholder
+
+        return {
+            "title": title,
+            "price": price,
+            "location": location,
+            "publication_time": publication_time,
+            "features": features,
+            "item_link": item_link,
+            "item_img": item_img,
+        }
+
+    except Exception as e:
+        logger.exception(f"Error during detailed Otodom parsing: {e}, item URL: {response.url}")
+
+
+def _parse_otodom_selectolax(response: Response) -> dict:
+    item = LexborHTMLParser(response.content)
+    try:
+        item_link = response.url
+        title = item.css_first("h1[data-cy='adPageAdTitle']").text()
+        price = item.css_first("strong[data-cy='adPageHeaderPrice']").text()
+        location = item.css_first("div[data-sentry-component='MapLink']").css_first("a").text()
+        publication_time = (
+            item.css_first("div[data-sentry-component='AdHistoryBase']")
+            .css_first("p")
+            .text()
+            .split(" ")[-1]
+        )
+        # Unlike BeautifulSoup's find_all, selectolax's css also matches the node itself
+        details = _descendants(item.css_first("div[data-sentry-component='AdDetailsBase']"), "div")[
+            0
+        ]
+        features = [
+            " ".join(sub.text() for sub in _descendants(feature, "div"))
+            for feature in _descendants(details, "div[data-sentry-element='ItemGridContainer']")
+        ]
+
+        try:
+            nodes = item.css("picture, img")
+            first_picture = next(i for i, node in enumerate(nodes) if node.tag == "picture")
+            img = next(node for node in nodes[first_picture:] if node.tag == "img")
+            item_img = img.attributes["src"]
+        except Exception as e:
+            logger.warning(f"Couldn't get image for {item_link}: {e!r}")
+            item_img = image_placeholder
+
+        return {
+            "title": title,
+            "price": price,
+            "location": location,
+            "publication_time": publication_time,
+            "features": features,
+            "item_link": item_link,
+            "item_img": item_img,
+        }
+
+    except Exception as e:
+        logger.exception(f"Error during detailed Otodom parsing: {e}, item URL: {response.url}")
+
+
+def _descendants(node, selector: str) -> list:
+    return [sub for sub in node.css(selector) if sub.mem_id != node.mem_id]
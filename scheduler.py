@@ -0,0 +1,117 @@
+import os
+import random
+import time
+import zlib
+from dataclasses import dataclass
+from math import inf
+from typing import Iterable
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", 30))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", 15 * 60))
+# Feeds are polled about as often as it takes them to get this many new ads
+POLL_TARGET_NEW_ADS = float(os.getenv("POLL_TARGET_NEW_ADS", 1))
+POLL_RATE_SMOOTHING = float(os.getenv("POLL_RATE_SMOOTHING", 0.3))
+POLL_JITTER = float(os.getenv("POLL_JITTER", 0.2))
+
+Feed = tuple[str, str, str]
+
+
+@dataclass
+class FeedState:
+    interval: float
+    next_poll_at: float
+    last_poll_at: float | None = None
+    rate: float | None = None  # new ads per second
+
+
+class FeedScheduler:
+    """
+    Polls every (city, ad_type, building_type) feed on its own interval derived from
+    the feed's smoothed arrival rate of new ads, so quiet feeds back off and hot ones
+    are polled more often. Poll times are jittered to spread requests over time
+    """
+
+    def __init__(
+        self,
+        min_interval: float = POLL_MIN_INTERVAL,
+        max_interval: float = POLL_MAX_INTERVAL,
+        target_new_ads: float = POLL_TARGET_NEW_ADS,
+        smoothing: float = POLL_RATE_SMOOTHING,
+        jitter: float = POLL_JITTER,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_new_ads = target_new_ads
+        self.smoothing = smoothing
+        self.jitter = jitter
+        self._feeds: dict[Feed, FeedState] = {}
+
+    def __len__(self) -> int:
+        return len(self._feeds)
+
+    def sync(self, feeds: Iterable[Feed]) -> None:
+        """
+        Starts tracking new feeds and forgets the ones that aren't passed.
+        New feeds get a random first poll within the min interval
+        """
+        feeds = set(feeds)
+        for feed in set(self._feeds) - feeds:
+            del self._feeds[feed]
+
+        now = time.monotonic()
+        for feed in feeds - set(self._feeds):
+            self._feeds[feed] = FeedState(
+                interval=self.min_interval,
+                next_poll_at=now + random.uniform(0, self.min_interval),
+            )
+
+    def due(self) -> list[Feed]:
+        """
+        Returns feeds whose poll time has come, they aren't due again until recorded
+        """
+        now = time.monotonic()
+        feeds = [feed for feed, state in self._feeds.items() if state.next_poll_at <= now]
+        for feed in feeds:
+            self._feeds[feed].next_poll_at = inf
+        return feeds
+
+    def record(self, feed: Feed, new_ads: int | None) -> float:
+        """
+        Updates the feed's arrival rate with the poll result and schedules its next poll.
+        `None` means the poll failed, then the interval is kept as is
+        """
+        state = self._feeds.get(feed)
+        if state is None:
+            return 0
+
+        now = time.monotonic()
+        if new_ads is not None:
+            # The first poll returns the feed's latest ads, not the ones that arrived since
+            if state.last_poll_at is not None:
+                observed_rate = new_ads / max(now - state.last_poll_at, 1)
+                if state.rate is None:
+                    state.rate = observed_rate
+                else:
+                    state.rate += self.smoothing * (observed_rate - state.rate)
+                state.interval = self.target_new_ads / state.rate if state.rate else inf
+                state.interval = min(max(state.interval, self.min_interval), self.max_interval)
+            state.last_poll_at = now
+
+        state.next_poll_at = now + state.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return state.interval
+
+    def seconds_until_next(self) -> float:
+        next_poll_at = min((state.next_poll_at for state in self._feeds.values()), default=inf)
+        return max(next_poll_at - time.monotonic(), 0)
+
+
+def feed_shard(feed: Feed, shard_count: int) -> int:
+    """
+    Stable across processes unlike `hash()`, so every scraper worker agrees on who polls a feed
+    """
+    return zlib.crc32("/".join(feed).encode()) % shard_count
@@ -1,241 +1,242 @@
 import asyncio
 import os
 import time
-from datetime import date, time as dt_time
-from typing import Literal
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Iterable
 
-import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 
+from ad import Ad, Card
+from cache import TTLCache
+from http_client import Response, close_session, fetch
 from logger import logger
-from utils import convert_utc_to_local
+from metrics import detail_fetch_seconds, listing_fetch_seconds, parse_failures, parse_seconds
+from parsers import extract_cards, parse_item, run_parser, shutdown_pool
+from utils import normalize_url
 
 
 load_dotenv()
 url_template = os.getenv("OLX_URL")
-image_placeholder = "https://archive.org/download/placeholder-image/placeholder-image.jpg"
+
+# Parsed Ads survive between scheduler cycles, so only new detail pages are downloaded,
+# and pages that failed to parse are not retried every minute
+ad_cache = TTLCache(
+    maxsize=int(os.getenv("AD_CACHE_SIZE", 5000)),
+    ttl=float(os.getenv("AD_CACHE_TTL", 6 * 60 * 60)),
+)
+failed_ads_cache = TTLCache(
+    maxsize=int(os.getenv("FAILED_AD_CACHE_SIZE", 1000)),
+    ttl=float(os.getenv("FAILED_AD_CACHE_TTL", 30 * 60)),
+)
+
+# Normalized card links already processed for every (city, ad_type, building_type) feed,
+# only cards above them get their detail pages downloaded
+WATERMARK_SIZE = int(os.getenv("WATERMARK_SIZE", 300))
+WATERMARK_MAX_PAGES = int(os.getenv("WATERMARK_MAX_PAGES", 3))
+feed_watermarks: dict[tuple[str, str, str], OrderedDict[str, None]] = {}
+
+BUILDING_TYPES = ["mieszkania", "domy", "biura-lokale", "stancje-pokoje"]
+AD_TYPES = ["wynajem", "sprzedaz"]
 
 
 async def get_last_n_items(
     city: str,
-    building_types: list[str] = [
-        "mieszkania",
-        "domy",
-        "biura-lokale",
-        "stancje-pokoje",
-    ],
-    ad_types: list[str] = ["wynajem", "sprzedaz"],
+    building_types: list[str] = BUILDING_TYPES,
+    ad_types: list[str] = AD_TYPES,
     n: int = 10,
-) -> tuple[str, dict[str, dict[str, list[dict]]]]:
-    loop = asyncio.get_event_loop()
-    start_time = time.time()
-
-    url_tasks = [
-        loop.run_in_executor(
-            None,
-            lambda url: requests.get(url),
-            url_template.format(city=city, building_type=building_type, ad_type=ad_type),
-        )
-        for building_type in building_types
-        for ad_type in ad_types
-    ]
-    url_responses = await asyncio.gather(*url_tasks, return_exceptions=True)
-
-    items = {}
-    for i, ad_type in enumerate(ad_types):
-        items[ad_type] = {}
-        for j, building_type in enumerate(building_types):
-            items[ad_type][building_type] = BeautifulSoup(
-                url_responses[i + j].content, "html.parser"
-            ).select("div[data-testid='l-card']:not([style*='display: none !important'])")
-
-    links = {}
-    for ad_type in ad_types:
-        links[ad_type] = {}
-        for building_type in building_types:
-            links[ad_type][building_type] = []
-            for item in items[ad_type][building_type][: n + 1]:
-                try:
-                    if item.select_one("[class=css-1dyfc0k]"):
-                        continue
-
-                    item_url = item.find("a").get("href")
-                    link = (
-                        f"https://olx.pl/{item_url}"
-                        if not item_url.startswith("https://www.otodom.pl")
-                        else item_url
-                    )
-                    links[ad_type][building_type].append(link)
-
-                except Exception as e:
-                    logger.exception(f"Error during scraping links: {e}")
-
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/131.0.0.0 Safari/537.36"
+    card_filter: Callable[[str, str, Card], bool] | None = None,
+) -> tuple[str, dict[str, dict[str, list[Ad]]]]:
+    """
+    Returns new ads of every feed in the order they were parsed
+    """
+    results = {
+        ad_type: {building_type: [] for building_type in building_types} for ad_type in ad_types
     }
+    async for ad_type, building_type, ad in stream_new_ads(
+        city, building_types, ad_types, n, card_filter
+    ):
+        results[ad_type][building_type].append(ad)
+    return city, results
 
-    item_tasks = {}
-    for ad_type in ad_types:
-        item_tasks[ad_type] = {}
-        for building_type in building_types:
-            item_tasks[ad_type][building_type] = [
-                loop.run_in_executor(None, lambda x: requests.get(x, headers=headers), link)
-                for link in links[ad_type][building_type]
-            ]
-
-    item_responses = {}
-    for ad_type in ad_types:
-        item_responses[ad_type] = {}
-        for building_type in building_types:
-            item_responses[ad_type][building_type] = await asyncio.gather(
-                *item_tasks[ad_type][building_type], return_exceptions=True
-            )
-
-    end_time = time.time()
-    logger.info(f"Scraping took: {end_time - start_time} seconds")
 
+async def stream_new_ads(
+    city: str,
+    building_types: list[str] = BUILDING_TYPES,
+    ad_types: list[str] = AD_TYPES,
+    n: int = 10,
+    card_filter: Callable[[str, str, Card], bool] | None = None,
+    new_cards: dict[tuple[str, str], int] | None = None,
+) -> AsyncIterator[tuple[str, str, Ad]]:
+    """
+    Yields `(ad_type, building_type, ad)` for new ads of every feed as soon as each ad
+    is parsed, so one slow page doesn't hold back the others. Cached ads come first,
+    detail pages are requested oldest first. Cards rejected by
+    `card_filter(ad_type, building_type, card)` don't get their detail pages downloaded.
+    `new_cards` is filled with the number of cards above each feed's watermark,
+    including the skipped and cached ones, which is the feed's real arrival of ads
+    """
     start_time = time.time()
-    results = {}
-    for ad_type in ad_types:
-        results[ad_type] = {}
-        for building_type in building_types:
-            results[ad_type][building_type] = []
-            for response in item_responses[ad_type][building_type]:
-                item_url = response.url
-                if item_url.startswith("https://www.olx.pl"):
-                    parsed_item = parse_olx(response)
-                    if parsed_item:
-                        results[ad_type][building_type].append(parsed_item)
-                elif item_url.startswith("https://www.otodom.pl"):
-                    parsed_item = parse_otodom(response)
-                    if parsed_item:
-                        results[ad_type][building_type].append(parsed_item)
-                else:
-                    logger.exception(f"Couldn't parse {item_url}")
-            results[ad_type][building_type] = list(reversed(results[ad_type][building_type]))
 
-    end_time = time.time()
-    logger.info(f"Parsing took: {end_time - start_time} seconds")
-
-    return city, results
+    feeds = [(ad_type, building_type) for ad_type in ad_types for building_type in building_types]
+    feed_cards = await asyncio.gather(
+        *(get_new_cards(city, ad_type, building_type, n) for ad_type, building_type in feeds)
+    )
 
+    if new_cards is not None:
+        new_cards.update((feed, len(cards)) for feed, cards in zip(feeds, feed_cards))
 
-def parse_olx(response: requests.Response) -> dict | None:
-    item = BeautifulSoup(response.content, "html.parser")
+    feed_keys = {}
+    tasks = {}
+    cached_count = 0
+    skipped_count = 0
+    failed_keys = set()
     try:
-        item_link = response.url
-        title = item.find("div", {"data-cy": "offer_title"}).text
-        price = (
-            item.find("div", {"data-testid": "ad-price-container"})
-            .text.lower()
-            .split(" do negocjacji")[0]
+        for (ad_type, building_type), cards in zip(feeds, feed_cards):
+            feed_keys[(ad_type, building_type)] = [normalize_url(card.url) for card in cards]
+            for card in reversed(cards):
+                key = normalize_url(card.url)
+                if key in failed_ads_cache:
+                    continue
+                if card_filter is not None and not card_filter(ad_type, building_type, card):
+                    skipped_count += 1
+                    continue
+
+                cached_item = ad_cache.get(key)
+                if cached_item is not None:
+                    cached_count += 1
+                    yield ad_type, building_type, cached_item
+                else:
+                    task = asyncio.create_task(load_ad(key, card.url))
+                    tasks[task] = (ad_type, building_type, key)
+
+        order = {task: i for i, task in enumerate(tasks)}
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=order.get):
+                ad_type, building_type, key = tasks[task]
+                if task.exception() is not None:
+                    logger.warning(f"Couldn't get ad details for {key}: {task.exception()!r}")
+                    failed_keys.add(key)
+                elif task.result() is not None:
+                    yield ad_type, building_type, task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    for (ad_type, building_type), keys in feed_keys.items():
+        remember_links(
+            (city, ad_type, building_type), (key for key in keys if key not in failed_keys)
         )
 
+    logger.info(
+        f"Getting {len(tasks) + cached_count} ads of {len(feeds)} feeds for {city} "
+        f"took {time.time() - start_time:.2f} seconds, {cached_count} ads were taken from cache, "
+        f"{skipped_count} ads were skipped by their listing cards"
+    )
+
+
+async def load_ad(key: str, url: str) -> Ad | None:
+    """
+    Downloads and parses an ad page, the result is cached by the ad's normalized link
+    """
+    ad = await parse_detail(await fetch_detail(url))
+    if ad:
+        ad.scraped_at = time.time()
+        ad_cache.set(key, ad)
+    else:
+        parse_failures.inc()
+        failed_ads_cache.set(key, True)
+    return ad
+
+
+async def get_new_cards(city: str, ad_type: str, building_type: str, n: int = 10) -> list[Card]:
+    """
+    Returns the feed's cards that are above its watermark, newest first.
+    The first time a feed is seen only its top `n` cards are returned
+    """
+    feed = (city, ad_type, building_type)
+    watermark = feed_watermarks.get(feed)
+    url = url_template.format(city=city, building_type=building_type, ad_type=ad_type)
+
+    new_cards = {}
+    for page in range(1, WATERMARK_MAX_PAGES + 1):
         try:
-            publication_time = convert_utc_to_local(
-                item.find("span", {"data-cy": "ad-posted-at"}).text.split(" o ")[-1]
+            with listing_fetch_seconds.time():
+                response = await fetch(get_page_url(url, page))
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(
+                f"Couldn't get page {page} of {ad_type}/{building_type} for {city}: {e!r}"
             )
-        except AttributeError:
-            logger.warning(f"Couldn't get publication_time for {item_link}")
-            publication_time = "N/A"
-
-        if isinstance(publication_time, dt_time):
-            publication_time = publication_time.strftime("%H:%M")
-        elif isinstance(publication_time, date):
-            if publication_time != date.today():
-                logger.warning(f"Publication date {publication_time} is not today, skipping")
-                return None
-            publication_time = publication_time.strftime("%B %d, %Y")
-
-        location = ", ".join(
-            "".join(i.a.text.split(" - ")[-1])
-            for i in item.find_all("li", {"data-testid": "breadcrumb-item"})[-2:]
+            break
+
+        page_cards = await run_parser(extract_cards, response.content)
+        if not watermark:
+            remember_links(feed, (normalize_url(card.url) for card in page_cards[n:]))
+            return page_cards[:n]
+
+        fresh_cards = [card for card in page_cards if normalize_url(card.url) not in watermark]
+        for card in fresh_cards:
+            new_cards.setdefault(normalize_url(card.url), card)
+
+        if not page_cards or len(fresh_cards) < len(page_cards):
+            break
+    else:
+        logger.warning(
+            f"All {WATERMARK_MAX_PAGES} pages of {ad_type}/{building_type} for {city} are new, "
+            f"some ads may have been missed"
         )
 
-        features = list(
-            reversed(
-                [
-                    item.text
-                    for item in (
-                        item.find("div", {"data-testid": "ad-parameters-container"}).find_all("p")
-                    )
-                ]
-            )
-        )
+    return list(new_cards.values())
 
-        try:
-            item_img = item.find("img", {"class": "css-1bmvjcs"})["srcset"].split(" ")[-2]
-        except (KeyError, TypeError):
-            logger.warning(f"Couldn't get image for {item_link}")
-            item_img = image_placeholder
-
-        return {
-            "title": title,
-            "price": price,
-            "location": location,
-            "publication_time": publication_time,
-            "features": features,
-            "item_link": item_link,
-            "item_img": item_img,
-        }
-
-    except Exception as e:
-        logger.exception(f"Error during detailed OLX parsing: {e}, item URL: {response.url}")
-
-
-def parse_otodom(response: requests.Response) -> dict:
-    item = BeautifulSoup(response.content, "html.parser")
-    try:
-        item_link = response.url
-        title = item.find("h1", {"data-cy": "adPageAdTitle"}).text
-        price = item.find("strong", {"data-cy": "adPageHeaderPrice"}).text
-        location = item.find("div", {"data-sentry-component": "MapLink"}).find("a").text
-        publication_time = (
-            item.find("div", {"data-sentry-component": "AdHistoryBase"})
-            .find("p")
-            .text.split(" ")[-1]
-        )
-        features = [
-            " ".join(sub.text for sub in feature.find_all("div"))
-            for feature in (
-                item.find("div", {"data-sentry-component": "AdDetailsBase"})
-                .find("div")
-                .find_all("div", {"data-sentry-element": "ItemGridContainer"})
-            )
-        ]
 
-        try:
-            item_img = item.find("picture").find_next("img")["src"]
-        except Exception as e:
-            logger.warning(f"Couldn't get image for {item_link}: {e}")
-            item_img = image_placeholder
+async def fetch_detail(url: str) -> Response:
+    """
+    Raises on error responses, so a throttled or failing page is retried on the next poll
+    instead of being parsed and remembered as broken
+    """
+    with detail_fetch_seconds.time():
+        response = await fetch(url)
+    response.raise_for_status()
+    return response
 
-        return {
-            "title": title,
-            "price": price,
-            "location": location,
-            "publication_time": publication_time,
-            "features": features,
-            "item_link": item_link,
-            "item_img": item_img,
-        }
 
-    except Exception as e:
-        logger.exception(f"Error during detailed Otodom parsing: {e}, item URL: {response.url}")
+async def parse_detail(response: Response) -> Ad | None:
+    with parse_seconds.time():
+        return await run_parser(parse_item, response)
+
+
+def get_page_url(url: str, page: int) -> str:
+    if page == 1:
+        return url
+    return f"{url}{'&' if '?' in url else '?'}page={page}"
+
+
+def remember_links(feed: tuple[str, str, str], keys: Iterable[str]) -> None:
+    watermark = feed_watermarks.setdefault(feed, OrderedDict())
+    for key in keys:
+        watermark[key] = None
+        watermark.move_to_end(key)
+    while len(watermark) > WATERMARK_SIZE:
+        watermark.popitem(last=False)
 
 
 async def verify_city(city: str) -> bool:
     url = url_template.format(city=city, building_type="mieszkania", ad_type="wynajem")
 
-    loop = asyncio.get_event_loop()
-    response = await loop.run_in_executor(None, requests.get, url)
+    response = await fetch(url)
 
     return response.status_code == 200
 
 
+async def _main() -> None:
+    try:
+        print(await get_last_n_items("warszawa", n=25))
+    finally:
+        await close_session()
+        shutdown_pool()
+
+
 if __name__ == "__main__":
-    res = asyncio.run(get_last_n_items("warszawa", 25))
-    print(res)
+    asyncio.run(_main())
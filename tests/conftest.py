@@ -0,0 +1,24 @@
+import pytest
+
+from ad import Ad
+
+
+def build_ad(number: int = 1, **fields) -> Ad:
+    url = f"https://www.olx.pl/d/oferta/mieszkanie-CID3-ID{number}.html"
+    defaults = dict(
+        title=f"Mieszkanie {number}",
+        price="2 500 zł",
+        location="Kraków, Krowodrza",
+        publication_time="Dzisiaj o 12:00",
+        features=["Powierzchnia: 40 m²"],
+        url=url,
+        canonical_url=url.replace("www.", ""),
+        image=f"https://img/{number}.jpg",
+        caption=f"Mieszkanie {number}",
+    )
+    return Ad(**{**defaults, **fields})
+
+
+@pytest.fixture
+def make_ad():
+    return build_ad
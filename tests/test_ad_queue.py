@@ -0,0 +1,115 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from ad import Ad, OwnerType
+from ad_queue import AdQueue, MemoryAdQueue, SqlAdQueue
+
+
+FEED = ("krakow", "wynajem", "mieszkania")
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def queue_factory(request, tmp_path):
+    if request.param == "memory":
+        return lambda retention=3600: MemoryAdQueue(retention)
+    url = f"sqlite+aiosqlite:///{tmp_path / 'ad_queue.sqlite'}"
+    return lambda retention=3600: SqlAdQueue(url, retention, poll_interval=0.01)
+
+
+def test_ad_dict_round_trip(make_ad):
+    ad = make_ad(
+        1,
+        price_value=2500,
+        area=40.5,
+        owner_type=OwnerType.PRIVATE,
+        published_at="2024-11-05T12:00:00+01:00",
+        coordinates=(50.07, 19.91),
+        images=["https://img/1.jpg", "https://img/2.jpg"],
+        scraped_at=1730800000.5,
+    )
+    assert Ad.from_dict(json.loads(json.dumps(ad.to_dict()))) == ad
+    assert Ad.from_dict(json.loads(json.dumps(make_ad(2).to_dict()))) == make_ad(2)
+
+
+def test_incomplete_backend_fails_on_creation():
+    class ReadOnlyQueue(AdQueue):
+        async def read(self, after, limit=100, timeout=0):
+            return []
+
+    with pytest.raises(TypeError):
+        ReadOnlyQueue()
+
+
+def test_read_commit_and_resume(queue_factory, make_ad):
+    async def run():
+        queue = queue_factory()
+        for number in range(5):
+            await queue.publish(FEED, make_ad(number))
+
+        assert await queue.committed("sender-0-of-1") is None
+        first = await queue.read(None, limit=3)
+        assert [entry.ad.title for entry in first] == [f"Mieszkanie {i}" for i in range(3)]
+        assert all(entry.feed == FEED for entry in first)
+        await queue.commit("sender-0-of-1", first[1].offset)
+
+        rest = await queue.read(first[-1].offset)
+        assert [entry.ad.title for entry in rest] == ["Mieszkanie 3", "Mieszkanie 4"]
+        assert await queue.read(rest[-1].offset) == []
+        await queue.close()
+        return queue
+
+    queue = asyncio.run(run())
+
+    async def resume():
+        # A restarted sender continues after its committed offset
+        restarted = queue if isinstance(queue, MemoryAdQueue) else queue_factory()
+        offset = await restarted.committed("sender-0-of-1")
+        entries = await restarted.read(offset)
+        assert [entry.ad.title for entry in entries] == [f"Mieszkanie {i}" for i in range(2, 5)]
+        # Other consumers keep their own offsets
+        assert await restarted.committed("sender-1-of-2") is None
+        assert len(await restarted.read(None)) == 5
+        await restarted.close()
+
+    asyncio.run(resume())
+
+
+def test_read_waits_for_new_ads(queue_factory, make_ad):
+    async def run():
+        queue = queue_factory()
+        await queue.publish(FEED, make_ad(0))
+        offset = (await queue.read(None))[-1].offset
+
+        started_at = time.monotonic()
+        assert await queue.read(offset, timeout=0.05) == []
+        assert time.monotonic() - started_at >= 0.04
+
+        reader = asyncio.create_task(queue.read(offset, timeout=5))
+        await asyncio.sleep(0.02)
+        await queue.publish(FEED, make_ad(1))
+        entries = await asyncio.wait_for(reader, 2)
+        assert [entry.ad.title for entry in entries] == ["Mieszkanie 1"]
+        await queue.close()
+
+    asyncio.run(run())
+
+
+def test_retention_trims_old_ads(queue_factory, make_ad):
+    async def run():
+        queue = queue_factory(retention=0.05)
+        await queue.publish(FEED, make_ad(0))
+        await queue.publish(FEED, make_ad(1))
+        await asyncio.sleep(0.1)
+        if isinstance(queue, SqlAdQueue):
+            # SQL queues trim at most once a minute
+            queue._trimmed_at = 0
+        await queue.publish(FEED, make_ad(2))
+
+        entries = await queue.read(None)
+        assert [entry.ad.title for entry in entries] == ["Mieszkanie 2"]
+        await queue.close()
+
+    asyncio.run(run())
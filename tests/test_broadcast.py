@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+
+import broadcast as broadcast_module
+from broadcast import run_broadcast
+from db.config import Broadcast
+from delivery import TokenBucket
+
+
+class StoppingBot:
+    """
+    Delivers messages until `stop_after` were sent, then fails like a stopped process
+    """
+
+    def __init__(self, stop_after: int | None = None):
+        self.stop_after = stop_after
+        self.sent: list[int] = []
+
+    async def send_message(self, chat_id: int, text: str):
+        if chat_id < 0:
+            return
+        if self.stop_after is not None and len(self.sent) == self.stop_after:
+            raise asyncio.CancelledError
+        self.sent.append(chat_id)
+
+
+def test_interrupted_broadcast_resumes_after_the_last_sent_user(monkeypatch):
+    users = [SimpleNamespace(user_id=user_id, chat_id=user_id) for user_id in range(1, 11)]
+    saved = []
+
+    async def get_active_users_page(after_user_id, limit):
+        return [user for user in users if user.user_id > (after_user_id or 0)][:limit]
+
+    async def save_broadcast_progress(broadcast, is_finished=False):
+        saved.append((broadcast.last_user_id, broadcast.delivered))
+
+    monkeypatch.setattr(broadcast_module, "get_active_users_page", get_active_users_page)
+    monkeypatch.setattr(broadcast_module, "save_broadcast_progress", save_broadcast_progress)
+    monkeypatch.setattr(broadcast_module, "BROADCAST_PAGE_SIZE", 4)
+
+    async def run():
+        first = Broadcast(id=1, admin_chat_id=-1, text="Hi", delivered=0, blocked=0, failed=0)
+        stopped_bot = StoppingBot(stop_after=6)
+        try:
+            await run_broadcast(stopped_bot, first, TokenBucket(1000))
+        except asyncio.CancelledError:
+            pass
+
+        # Restarted from what was saved
+        last_user_id, delivered = saved[-1]
+        resumed = Broadcast(
+            id=1,
+            admin_chat_id=-1,
+            text="Hi",
+            last_user_id=last_user_id,
+            delivered=delivered,
+            blocked=0,
+            failed=0,
+        )
+        bot = StoppingBot()
+        await run_broadcast(bot, resumed, TokenBucket(1000))
+        return stopped_bot, bot, resumed
+
+    stopped_bot, bot, resumed = asyncio.run(run())
+    assert stopped_bot.sent + bot.sent == list(range(1, 11))
+    assert resumed.delivered == 10
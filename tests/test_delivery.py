@@ -0,0 +1,143 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendPhoto
+
+from delivery import Delivery, DeliveryQueue
+
+
+class FakeBot:
+    """
+    Records sent photos, chats' queued exceptions are raised by their next sends
+    """
+
+    def __init__(self, failures: dict[int, list[Exception]] | None = None):
+        self.failures = failures or {}
+        self.sent: list[tuple[int, str]] = []
+
+    async def send_photo(self, chat_id: int, photo: str, caption: str):
+        await asyncio.sleep(0)
+        if self.failures.get(chat_id):
+            raise self.failures[chat_id].pop(0)
+        self.sent.append((chat_id, caption))
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"file-{len(self.sent)}")])
+
+
+def make_queue(bot: FakeBot, sent: list[Delivery], **options) -> DeliveryQueue:
+    async def on_sent(delivery: Delivery) -> None:
+        sent.append(delivery)
+
+    options = {"workers": 1, "global_rate": 1000, "chat_interval": 0, **options}
+    return DeliveryQueue(bot, on_sent=on_sent, **options)
+
+
+async def wait_until_empty(queue: DeliveryQueue, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while len(queue):
+        assert time.monotonic() < deadline, "deliveries weren't finished in time"
+        await asyncio.sleep(0.01)
+
+
+def retry_after(seconds: int) -> TelegramRetryAfter:
+    return TelegramRetryAfter(SendPhoto(chat_id=1, photo="x"), "Too Many Requests", seconds)
+
+
+def forbidden() -> TelegramForbiddenError:
+    return TelegramForbiddenError(SendPhoto(chat_id=1, photo="x"), "bot was blocked by the user")
+
+
+def test_chats_are_served_round_robin(make_ad):
+    async def run():
+        bot = FakeBot()
+        sent = []
+        queue = make_queue(bot, sent)
+        for number in range(5):
+            queue.put(Delivery(1, 1, make_ad(number)))
+        queue.put(Delivery(2, 2, make_ad(100)))
+        queue.start()
+        await wait_until_empty(queue)
+        await queue.stop()
+        return bot, sent
+
+    bot, sent = asyncio.run(run())
+    assert [chat_id for chat_id, _ in bot.sent] == [1, 2, 1, 1, 1, 1]
+    # Ads of a chat keep their order
+    assert [caption for chat_id, caption in bot.sent if chat_id == 1] == [
+        f"Mieszkanie {number}" for number in range(5)
+    ]
+    assert len(sent) == 6
+
+
+def test_duplicate_pending_deliveries_are_dropped(make_ad):
+    queue = make_queue(FakeBot(), [])
+    assert queue.put(Delivery(1, 1, make_ad(1)))
+    assert not queue.put(Delivery(1, 1, make_ad(1)))
+    assert queue.put(Delivery(2, 2, make_ad(1)))
+    assert len(queue) == 2
+
+
+def test_retry_after_delays_only_the_throttled_chat(make_ad):
+    async def run():
+        bot = FakeBot({1: [retry_after(1)]})
+        sent = []
+        queue = make_queue(bot, sent)
+        throttled = Delivery(1, 1, make_ad(1))
+        queue.put(throttled)
+        queue.put(Delivery(2, 2, make_ad(2)))
+        started_at = time.monotonic()
+        queue.start()
+
+        await asyncio.sleep(0.3)
+        assert bot.sent == [(2, "Mieszkanie 2")]
+        assert queue.is_pending(throttled)
+
+        await wait_until_empty(queue)
+        await queue.stop()
+        return bot, sent, throttled, time.monotonic() - started_at
+
+    bot, sent, throttled, elapsed = asyncio.run(run())
+    assert bot.sent == [(2, "Mieszkanie 2"), (1, "Mieszkanie 1")]
+    assert elapsed >= 1
+    # Flood control isn't the ad's fault, so it doesn't use up its retries
+    assert throttled.attempts == 0
+    assert len(sent) == 2
+
+
+def test_forbidden_chat_is_dropped(make_ad):
+    async def run():
+        bot = FakeBot({1: [forbidden()]})
+        sent = []
+        queue = make_queue(bot, sent)
+        blocked = [Delivery(1, 1, make_ad(number)) for number in range(3)]
+        for delivery in blocked:
+            queue.put(delivery)
+        queue.put(Delivery(2, 2, make_ad(100)))
+        queue.start()
+        await wait_until_empty(queue)
+        await queue.stop()
+        return bot, sent, queue, blocked
+
+    bot, sent, queue, blocked = asyncio.run(run())
+    assert bot.sent == [(2, "Mieszkanie 100")]
+    assert [delivery.chat_id for delivery in sent] == [2]
+    assert not any(queue.is_pending(delivery) for delivery in blocked)
+
+
+def test_failing_delivery_is_given_up_after_max_retries(make_ad):
+    async def run():
+        bot = FakeBot({1: [RuntimeError("bad image")] * 2 + [RuntimeError("still bad")]})
+        sent = []
+        queue = make_queue(bot, sent, max_retries=3)
+        failing = Delivery(1, 1, make_ad(1))
+        queue.put(failing)
+        queue.start()
+        await wait_until_empty(queue)
+        await queue.stop()
+        return bot, sent, failing
+
+    bot, sent, failing = asyncio.run(run())
+    assert bot.sent == []
+    assert sent == []
+    assert failing.attempts == 3
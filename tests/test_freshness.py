@@ -0,0 +1,33 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from freshness import FreshnessStats, QuantileSketch
+
+
+def test_sketch_quantiles_are_within_relative_accuracy():
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in range(1, 10001):
+        sketch.add(value)
+    assert sketch.quantile(0.5) == pytest.approx(5000, rel=0.01)
+    assert sketch.quantile(0.95) == pytest.approx(9500, rel=0.01)
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_ads_published_in_the_future_are_not_recorded(make_ad):
+    stats = FreshnessStats(relative_accuracy=0.01, throughput_window=60)
+    now = datetime.now().astimezone()
+    fresh = make_ad(
+        1, published_at=(now - timedelta(minutes=5)).isoformat(), scraped_at=time.time() - 60
+    )
+    # An ad from 23:59 yesterday whose "23:59" was read as today's
+    from_future = make_ad(2, published_at=(now + timedelta(hours=23)).isoformat())
+
+    stats.record_delivery("krakow", fresh)
+    stats.record_delivery("krakow", from_future)
+
+    assert stats.sent_count == 2
+    assert stats._delivered["krakow"].count == 1
+    assert stats._delivered["krakow"].quantile(0.5) == pytest.approx(300, rel=0.02)
+    assert stats._scraped["krakow"].quantile(0.5) == pytest.approx(240, rel=0.02)
@@ -0,0 +1,152 @@
+import itertools
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from ad import Card, OwnerType
+from matcher import AdMatcher
+
+
+CITIES = ["krakow", "warszawa"]
+AD_TYPES = ["wynajem", "sprzedaz"]
+BUILDING_TYPES = ["mieszkania", "domy", "stancje-pokoje"]
+
+
+def make_user(user_id: int, **filters) -> SimpleNamespace:
+    return SimpleNamespace(
+        user_id=user_id,
+        chat_id=user_id,
+        city=filters.get("city", "krakow"),
+        ad_type_filter=filters.get("ad_type_filter"),
+        building_type_filter=filters.get("building_type_filter"),
+        min_price_filter=filters.get("min_price_filter"),
+        max_price_filter=filters.get("max_price_filter"),
+        min_surface_area_filter=filters.get("min_surface_area_filter"),
+        private_only_filter=filters.get("private_only_filter"),
+    )
+
+
+def accepts(user, city: str, ad_type: str, building_type: str, ad) -> bool:
+    """
+    The per-user filter the matcher replaced, with the semantics it settled on:
+    a priceless ad only goes to users without price filters, an unknown area doesn't
+    exclude anybody and private-only means a private owner
+    """
+    if user.city != city:
+        return False
+    if user.ad_type_filter and user.ad_type_filter != ad_type:
+        return False
+    if user.building_type_filter and user.building_type_filter != building_type:
+        return False
+    if ad.price_value is None:
+        if user.min_price_filter or user.max_price_filter:
+            return False
+    else:
+        if user.min_price_filter and ad.price_value < user.min_price_filter:
+            return False
+        if user.max_price_filter and ad.price_value > user.max_price_filter:
+            return False
+    if (
+        user.min_surface_area_filter
+        and ad.area is not None
+        and ad.area < user.min_surface_area_filter
+    ):
+        return False
+    if user.private_only_filter and ad.owner_type is not OwnerType.PRIVATE:
+        return False
+    return True
+
+
+def make_population(count: int, rng: random.Random) -> list[SimpleNamespace]:
+    users = []
+    for user_id in range(1, count + 1):
+        min_price = rng.choice([None, 0, 2000, 2500, 3000])
+        users.append(
+            make_user(
+                user_id,
+                city=rng.choice(CITIES),
+                ad_type_filter=rng.choice(AD_TYPES + [None, ""]),
+                building_type_filter=rng.choice(BUILDING_TYPES + [None]),
+                min_price_filter=min_price,
+                max_price_filter=rng.choice([None, (min_price or 1500) + 1500]),
+                min_surface_area_filter=rng.choice([None, 0, 30, 45]),
+                private_only_filter=rng.choice([None, False, True]),
+            )
+        )
+    return users
+
+
+def test_match_agrees_with_per_user_filter(make_ad):
+    rng = random.Random(7)
+    users = make_population(300, rng)
+    matcher = AdMatcher(users)
+
+    ads = [
+        make_ad(
+            number,
+            price_value=price,
+            area=area,
+            owner_type=owner_type,
+        )
+        for number, (price, area, owner_type) in enumerate(
+            itertools.product(
+                [None, 1500, 2000, 2500, 2999, 3000, 4500, 9000],
+                [None, 25.5, 30, 44.9, 45, 80],
+                list(OwnerType),
+            )
+        )
+    ]
+    for ad in ads:
+        for city, ad_type, building_type in itertools.product(CITIES, AD_TYPES, BUILDING_TYPES):
+            matched = matcher.match(city, ad_type, building_type, ad)
+            expected = [
+                user.user_id for user in users if accepts(user, city, ad_type, building_type, ad)
+            ]
+            assert sorted(user.user_id for user in matched) == sorted(expected)
+
+            # Listing cards may only let through more, never less
+            card = Card(ad.url, ad.price_value, ad.area)
+            if matched:
+                assert matcher.accepts_card(city, ad_type, building_type, card)
+
+
+@pytest.mark.parametrize(
+    "filters, ad_fields, expected",
+    [
+        ({}, {"price_value": None}, True),
+        ({"min_price_filter": 2000}, {"price_value": None}, False),
+        ({"max_price_filter": 3000}, {"price_value": None}, False),
+        ({"min_price_filter": 2000, "max_price_filter": 3000}, {"price_value": 3000}, True),
+        ({"min_price_filter": 2000, "max_price_filter": 3000}, {"price_value": 3001}, False),
+        ({"min_surface_area_filter": 40}, {"area": None}, True),
+        ({"min_surface_area_filter": 40}, {"area": 39.9}, False),
+        ({"min_surface_area_filter": 40}, {"area": 40.0}, True),
+        ({"private_only_filter": True}, {"owner_type": OwnerType.PRIVATE}, True),
+        ({"private_only_filter": True}, {"owner_type": OwnerType.DEVELOPER}, False),
+        ({"private_only_filter": True}, {"owner_type": OwnerType.UNKNOWN}, False),
+        ({"ad_type_filter": None, "building_type_filter": None}, {}, True),
+        ({"ad_type_filter": "sprzedaz"}, {}, False),
+        ({"building_type_filter": "domy"}, {}, False),
+        ({"city": "warszawa"}, {}, False),
+    ],
+)
+def test_match_edge_cases(make_ad, filters, ad_fields, expected):
+    matcher = AdMatcher([make_user(1, **filters)])
+    ad = make_ad(1, **{"price_value": 2500, "area": 50.0, **ad_fields})
+    matched = matcher.match("krakow", "wynajem", "mieszkania", ad)
+    assert [user.user_id for user in matched] == ([1] if expected else [])
+
+
+def test_feeds_expand_any_types():
+    matcher = AdMatcher(
+        [
+            make_user(1, ad_type_filter="wynajem", building_type_filter="mieszkania"),
+            make_user(2, city="warszawa", ad_type_filter="sprzedaz"),
+        ]
+    )
+    feeds = matcher.feeds()
+    assert ("krakow", "wynajem", "mieszkania") in feeds
+    assert ("krakow", "wynajem", "domy") not in feeds
+    assert ("warszawa", "sprzedaz", "domy") in feeds
+    assert not any(city == "warszawa" and ad_type == "wynajem" for city, ad_type, _ in feeds)
@@ -0,0 +1,95 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import utils
+from http_client import Response
+from parsers import parse_olx_state, parse_otodom_state
+
+
+# 23:00 UTC on Oct 18 is already Oct 19 in Warsaw
+NOW = datetime(2026, 10, 18, 23, 0, tzinfo=timezone.utc)
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW.astimezone(tz) if tz else NOW.replace(tzinfo=None)
+
+
+@pytest.fixture(autouse=True)
+def frozen_now(monkeypatch):
+    monkeypatch.setattr(utils, "datetime", FrozenDatetime)
+
+
+def olx_page(created_time: str) -> Response:
+    state = {
+        "ad": {
+            "ad": {
+                "id": 1,
+                "title": "Mieszkanie 2 pokoje",
+                "createdTime": created_time,
+                "isBusiness": False,
+                "price": {"displayValue": "2 500 zł"},
+                "params": [
+                    {"key": "m", "name": "Powierzchnia", "value": "40 m²", "normalizedValue": "40"}
+                ],
+                "photos": ["https://img/1;s={width}x{height}"],
+                "location": {"cityName": "Kraków", "districtName": "Krowodrza"},
+                "map": {"lat": 50.07, "lon": 19.92},
+            }
+        }
+    }
+    content = f"<script>window.__PRERENDERED_STATE__= {json.dumps(json.dumps(state))};</script>"
+    return Response(
+        url="https://www.olx.pl/d/oferta/ID1.html", status_code=200, content=content.encode()
+    )
+
+
+def otodom_page(created_at: str) -> Response:
+    data = {
+        "props": {
+            "pageProps": {
+                "ad": {
+                    "title": "3 pokoje",
+                    "createdAt": created_at,
+                    "advertiserType": "private",
+                    "target": {"Price": 689000, "Area": "54.2"},
+                    "characteristics": [],
+                    "images": [{"large": "https://img/1.jpg"}],
+                }
+            }
+        }
+    }
+    content = f'<script id="__NEXT_DATA__" type="application/json">{json.dumps(data)}</script>'
+    return Response(
+        url="https://www.otodom.pl/pl/oferta/ID1", status_code=200, content=content.encode()
+    )
+
+
+def test_olx_ad_published_after_midnight_in_warsaw_is_today():
+    parsed = parse_olx_state(olx_page("2026-10-19T00:30:00+02:00"))
+    assert parsed["publication_time"] == "00:30"
+    assert parsed["area"] == 40.0
+    assert parsed["item_img"] == "https://img/1;s=1000x750"
+
+
+def test_olx_ad_from_yesterday_in_warsaw_is_skipped():
+    # Still Oct 18 by the server's UTC clock, but yesterday in Warsaw
+    assert parse_olx_state(olx_page("2026-10-18T23:30:00+02:00")) is None
+
+
+def test_otodom_publication_time_uses_the_warsaw_date():
+    assert parse_otodom_state(otodom_page("2026-10-18T22:30:00Z"))["publication_time"] == "00:30"
+    assert parse_otodom_state(otodom_page("2026-10-18T21:30:00Z"))["publication_time"] == (
+        "October 18, 2026"
+    )
+
+
+def test_missing_state_raises():
+    empty = Response(url="https://www.olx.pl/d/oferta/ID1.html", status_code=200, content=b"<html>")
+    with pytest.raises(LookupError):
+        parse_olx_state(empty)
+    with pytest.raises(LookupError):
+        parse_otodom_state(empty)
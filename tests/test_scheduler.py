@@ -0,0 +1,103 @@
+import pytest
+
+import scheduler
+from scheduler import FeedScheduler, feed_shard
+
+
+FEED = ("krakow", "wynajem", "mieszkania")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(scheduler.time, "monotonic", clock)
+    return clock
+
+
+def make_scheduler(**options) -> FeedScheduler:
+    options = {
+        "min_interval": 30,
+        "max_interval": 900,
+        "target_new_ads": 1,
+        "smoothing": 1,
+        "jitter": 0,
+        **options,
+    }
+    feed_scheduler = FeedScheduler(**options)
+    feed_scheduler.sync([FEED])
+    return feed_scheduler
+
+
+def poll(feed_scheduler: FeedScheduler, clock: Clock, after: float, new_ads: int | None) -> float:
+    clock.now += after
+    return feed_scheduler.record(FEED, new_ads)
+
+
+def test_first_poll_keeps_the_min_interval(clock):
+    feed_scheduler = make_scheduler()
+    # The first poll returns the feed's latest ads, not an arrival rate
+    assert poll(feed_scheduler, clock, 0, 50) == 30
+
+
+def test_interval_follows_the_arrival_rate(clock):
+    feed_scheduler = make_scheduler()
+    poll(feed_scheduler, clock, 0, 10)
+    # One new ad per 120 seconds
+    assert poll(feed_scheduler, clock, 240, 2) == pytest.approx(120)
+
+
+def test_interval_is_clamped(clock):
+    feed_scheduler = make_scheduler()
+    poll(feed_scheduler, clock, 0, 10)
+    assert poll(feed_scheduler, clock, 60, 30) == 30
+    assert poll(feed_scheduler, clock, 60, 0) == 900
+    assert poll(feed_scheduler, clock, 60, 1) == 60
+    assert poll(feed_scheduler, clock, 10000, 1) == 900
+
+
+def test_rate_is_smoothed(clock):
+    feed_scheduler = make_scheduler(smoothing=0.5)
+    poll(feed_scheduler, clock, 0, 10)
+    assert poll(feed_scheduler, clock, 100, 1) == pytest.approx(100)
+    # Half way from 1/100 to 0 ads per second
+    assert poll(feed_scheduler, clock, 100, 0) == pytest.approx(200)
+
+
+def test_failed_poll_keeps_the_interval(clock):
+    feed_scheduler = make_scheduler()
+    poll(feed_scheduler, clock, 0, 10)
+    assert poll(feed_scheduler, clock, 200, 1) == pytest.approx(200)
+    assert poll(feed_scheduler, clock, 200, None) == pytest.approx(200)
+    # The period is counted from the last successful poll, 4 ads in 400 seconds
+    assert poll(feed_scheduler, clock, 200, 4) == pytest.approx(100)
+
+
+def test_feed_is_not_due_while_polled(clock):
+    feed_scheduler = make_scheduler()
+    clock.now += 30
+    assert feed_scheduler.due() == [FEED]
+    assert feed_scheduler.due() == []
+    interval = feed_scheduler.record(FEED, 0)
+    assert feed_scheduler.seconds_until_next() == pytest.approx(interval)
+
+
+def test_unknown_feed_is_ignored(clock):
+    feed_scheduler = make_scheduler()
+    assert feed_scheduler.record(("gdansk", "wynajem", "domy"), 5) == 0
+    assert len(feed_scheduler) == 1
+
+
+def test_feed_shards_are_stable_and_cover_all_feeds():
+    feeds = [(city, "wynajem", "mieszkania") for city in ("krakow", "warszawa", "gdansk", "lodz")]
+    shards = [feed_shard(feed, 3) for feed in feeds]
+    assert shards == [feed_shard(feed, 3) for feed in feeds]
+    assert all(0 <= shard < 3 for shard in shards)
+    assert {feed_shard(feed, 1) for feed in feeds} == {0}
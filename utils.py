@@ -1,8 +1,10 @@
+import re
 import unicodedata
 import pytz
 
 from datetime import datetime, date, time
 from difflib import SequenceMatcher
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from logger import logger
 
@@ -51,6 +53,54 @@ def convert_utc_to_local(utc_time_str: str, local_timezone: str = "Europe/Warsaw
             return utc_time_str
 
 
+def to_local_datetime(iso_time_str: str, local_timezone: str = "Europe/Warsaw") -> datetime:
+    timestamp = datetime.fromisoformat(iso_time_str)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=pytz.utc)
+    return timestamp.astimezone(pytz.timezone(local_timezone))
+
+
+def local_today(local_timezone: str = "Europe/Warsaw") -> date:
+    """
+    Today's date where the ads are published, the server may run in another timezone
+    """
+    return datetime.now(pytz.timezone(local_timezone)).date()
+
+
+def today_at(time_str: str, local_timezone: str = "Europe/Warsaw") -> datetime | None:
+    """
+    Today's local datetime of an "HH:MM" time, None for other strings
+    """
+    try:
+        local_time = datetime.strptime(time_str, "%H:%M").time()
+    except ValueError:
+        return None
+
+    timezone = pytz.timezone(local_timezone)
+    return timezone.localize(datetime.combine(local_today(local_timezone), local_time))
+
+
+TRACKING_QUERY_PARAMS = ("reason", "search_reason", "fbclid", "gclid", "ref", "source")
+
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of an ad URL: no `www.`, no duplicated slashes, no fragment
+    and no tracking query parameters
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower().removeprefix("www.")
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if key.lower() not in TRACKING_QUERY_PARAMS and not key.lower().startswith("utm_")
+        )
+    )
+    return urlunsplit(("https", host, path, query, ""))
+
+
 def remove_accents(text: str) -> str:
     # Normalize the text to separate accents from letters
     normalized_text = unicodedata.normalize("NFD", text)